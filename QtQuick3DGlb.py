@@ -0,0 +1,761 @@
+#############################################################################
+##
+## Copyright (C) 2022 Andy Nichols <nezticle@gmail.com>
+##
+## You may use this file under the terms of the BSD license as follows:
+##
+## "Redistribution and use in source and binary forms, with or without
+## modification, are permitted provided that the following conditions are
+## met:
+##   * Redistributions of source code must retain the above copyright
+##     notice, this list of conditions and the following disclaimer.
+##   * Redistributions in binary form must reproduce the above copyright
+##     notice, this list of conditions and the following disclaimer in
+##     the documentation and/or other materials provided with the
+##     distribution.
+##
+## THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+## "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+## LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+## A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+## OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+## SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+## LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+## DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+## THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+## (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+## OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE."
+##
+##
+#############################################################################
+
+import re
+import json
+import struct
+from QtQuick3DMesh import Mesh, componentTypeCodes, componentTypeSizes, unpackArray, packArray, crossVec3, scaleVec3
+from array import array
+from itertools import repeat
+from operator import truediv
+
+# glTF 2.0 binary container (.glb) support.
+#
+# Export keeps the mesh buffers as they are: the interleaved vertex buffer
+# becomes a single bufferView with byteStride == stride and every vertex
+# buffer entry becomes an accessor into it, the index buffer becomes a single
+# bufferView that every subset (primitive) points into.  Nothing is repacked
+# per vertex, the buffers are just concatenated into the BIN chunk.  glTF only
+# knows counter clockwise front faces, so clockwise triangle meshes get a
+# copy of the index buffer with two corners of every triangle swapped, and
+# 32bit (or float) joint indices get a narrowed JOINTS_0 copy next to them.
+#
+# Import does the reverse, when the glTF attributes already share a single
+# interleaved bufferView (like files written by this exporter) the bytes are
+# copied in one go, otherwise the attributes are interleaved with one strided
+# slice copy per byte of each attribute.
+
+GLB_MAGIC = 0x46546C67
+GLB_JSON_CHUNK = 0x4E4F534A
+GLB_BIN_CHUNK = 0x004E4942
+
+ARRAY_BUFFER = 34962
+ELEMENT_ARRAY_BUFFER = 34963
+
+# Mesh componentType -> glTF componentType (glTF has no 64bit or float16 types)
+gltfComponentTypes = {1: 5121, 2: 5120, 3: 5123, 4: 5122, 5: 5125, 10: 5126}
+qtComponentTypes = {value: key for key, value in gltfComponentTypes.items()}
+
+gltfAccessorTypes = {1: "SCALAR", 2: "VEC2", 3: "VEC3", 4: "VEC4", 16: "MAT4"}
+gltfAccessorSizes = {value: key for key, value in gltfAccessorTypes.items()}
+
+# Mesh drawMode -> glTF primitive mode (Patches has no glTF equivalent)
+gltfModes = {1: 0, 2: 3, 3: 2, 4: 1, 5: 5, 6: 6, 7: 4}
+qtDrawModes = {value: key for key, value in gltfModes.items()}
+
+# vertex entry name -> (glTF semantic, allowed componentTypes, allowed numComponents)
+gltfSemantics = {
+    'attr_pos': ('POSITION', (10,), (3,)),
+    'attr_norm': ('NORMAL', (10,), (3,)),
+    'attr_uv0': ('TEXCOORD_0', (10, 1, 3), (2,)),
+    'attr_uv1': ('TEXCOORD_1', (10, 1, 3), (2,)),
+    'attr_textan': ('TANGENT', (10,), (4,)),
+    'attr_joints': ('JOINTS_0', (1, 3), (4,)),
+    'attr_weights': ('WEIGHTS_0', (10, 1, 3), (4,)),
+    'attr_colors': ('COLOR_0', (10, 1, 3), (3, 4)),
+}
+qtAttributeNames = {value[0]: key for key, value in gltfSemantics.items()}
+
+# morph target entries are named attr_tpos0, attr_tnorm1, ...
+morphTargetName = re.compile(r'attr_t(pos|norm|tan|binorm)(\d+)')
+gltfMorphSemantics = {'pos': 'POSITION', 'norm': 'NORMAL', 'tan': 'TANGENT'}
+qtMorphNames = {value: key for key, value in gltfMorphSemantics.items()}
+
+def gltfAttributeName(entry):
+    # entries glTF has no semantic for (or that don't fit the semantic's
+    # constraints) are kept as application specific "_attr_*" attributes
+    name = entry.name.rstrip('\x00')
+    if name in gltfSemantics:
+        semantic, componentTypes, numComponents = gltfSemantics[name]
+        if entry.componentType in componentTypes and entry.numComponents in numComponents:
+            return semantic
+    return "_" + name
+
+def qtAttributeName(semantic):
+    if semantic in qtAttributeNames:
+        return qtAttributeNames[semantic]
+    if semantic.startswith("_attr_"):
+        return semantic[1:]
+    return None
+
+# largest value of the normalized integer componentTypes
+normalizedScales = {1: 255.0, 2: 127.0, 3: 65535.0, 4: 32767.0}
+
+def packColumns(columns, typecode):
+    # interleaves per component sequences into tightly packed little endian data
+    values = array(typecode, bytes(len(columns[0]) * len(columns) * array(typecode).itemsize))
+    for component, column in enumerate(columns):
+        values[component::len(columns)] = array(typecode, column)
+    return packArray(values)
+
+def flipWinding(indexes):
+    # swap the last two corners of every triangle, glTF front faces are
+    # always counter clockwise so clockwise meshes are exported flipped
+    flipped = array(indexes.typecode, indexes)
+    end = len(indexes) - len(indexes) % 3
+    flipped[1:end:3], flipped[2:end:3] = indexes[2:end:3], indexes[1:end:3]
+    return flipped
+
+def floatBounds(data, firstItemOffset, stride, count, numComponents):
+    # min/max per component via strided slices over a float array
+    values = unpackArray(data[:count * stride], 10)
+    step = stride // 4
+    first = firstItemOffset // 4
+    minimum = []
+    maximum = []
+    for component in range(numComponents):
+        column = values[first + component::step]
+        minimum.append(min(column))
+        maximum.append(max(column))
+    return minimum, maximum
+
+class GlbFile:
+    class GltfBuilder:
+        def __init__(self):
+            self.gltf = {
+                "asset": {"version": "2.0", "generator": "QtQuick3DMesh"},
+                "scene": 0,
+                "scenes": [{"nodes": []}],
+                "nodes": [],
+                "meshes": [],
+                "accessors": [],
+                "bufferViews": [],
+                "buffers": []
+            }
+            self.binChunks = []
+            self.binLength = 0
+
+        def addBufferView(self, data, byteStride=None, target=None):
+            bufferView = {"buffer": 0, "byteOffset": self.binLength, "byteLength": len(data)}
+            if byteStride is not None:
+                bufferView["byteStride"] = byteStride
+            if target is not None:
+                bufferView["target"] = target
+            # keep a reference only, the BIN chunk is joined once when saving
+            self.binChunks.append(data)
+            self.binLength += len(data)
+            if self.binLength % 4:
+                padding = bytes(4 - self.binLength % 4)
+                self.binChunks.append(padding)
+                self.binLength += len(padding)
+            self.gltf["bufferViews"].append(bufferView)
+            return len(self.gltf["bufferViews"]) - 1
+
+        def addAccessor(self, accessor):
+            self.gltf["accessors"].append(accessor)
+            return len(self.gltf["accessors"]) - 1
+
+        def addNode(self, node, root=True):
+            self.gltf["nodes"].append(node)
+            nodeIndex = len(self.gltf["nodes"]) - 1
+            if root:
+                self.gltf["scenes"][0]["nodes"].append(nodeIndex)
+            return nodeIndex
+
+        def save(self, outputFile):
+            if self.binLength > 0:
+                self.gltf["buffers"].append({"byteLength": self.binLength})
+            for key in ("nodes", "meshes", "accessors", "bufferViews", "buffers"):
+                if not self.gltf[key]:
+                    del self.gltf[key]
+            jsonData = json.dumps(self.gltf, separators=(',', ':')).encode('utf-8')
+            jsonData += b' ' * ((4 - len(jsonData) % 4) % 4)
+            totalLength = 12 + 8 + len(jsonData)
+            if self.binLength > 0:
+                totalLength += 8 + self.binLength
+            with open(outputFile, "wb") as glbFile:
+                glbFile.write(struct.pack("<III", GLB_MAGIC, 2, totalLength))
+                glbFile.write(struct.pack("<II", len(jsonData), GLB_JSON_CHUNK))
+                glbFile.write(jsonData)
+                if self.binLength > 0:
+                    glbFile.write(struct.pack("<II", self.binLength, GLB_BIN_CHUNK))
+                    for chunk in self.binChunks:
+                        glbFile.write(chunk)
+
+    def __init__(self):
+        self.meshes = {}
+        self.gltf = {}
+        self.binData = memoryview(b'')
+
+    def saveGlbFile(self, outputFile):
+        print ('Output file is ', outputFile)
+        builder = self.GltfBuilder()
+        for meshId, mesh in self.meshes.items():
+            self.exportMesh(builder, meshId, mesh)
+        try:
+            builder.save(outputFile)
+        except OSError:
+            print("Could not open/create file:", outputFile)
+
+    def exportMesh(self, builder, meshId, mesh):
+        vertexBuffer = mesh.vertexBuffer
+        stride = vertexBuffer.stride
+        vertexCount = len(vertexBuffer.data) // stride if stride else 0
+        if vertexCount == 0:
+            print("Skipping mesh without vertex data:", meshId)
+            return False
+        if mesh.drawMode not in gltfModes:
+            print("Skipping mesh with unsupported drawMode:", meshId, mesh.drawMode)
+            return False
+        if stride % 4 or stride > 252:
+            print("Skipping mesh with stride not representable in glTF:", meshId, stride)
+            return False
+        flip = mesh.winding == 1 and mesh.drawMode in (5, 6, 7)
+        if flip and mesh.drawMode != 7:
+            print("Skipping clockwise mesh with drawMode not representable in glTF:", meshId, mesh.drawMode)
+            return False
+        if flip and any(part.offset % 3 or part.count % 3 for part in mesh.subsets + mesh.lods):
+            print("Skipping clockwise mesh with subsets not made of whole triangles:", meshId)
+            return False
+
+        vertexView = builder.addBufferView(memoryview(vertexBuffer.data)[:vertexCount * stride], stride, ARRAY_BUFFER)
+        attributes = {}
+        targets = {}
+        for entry in vertexBuffer.entries:
+            if entry.name == 'attr_joints\x00' and entry.numComponents == 4 and entry.componentType not in (1, 3):
+                # JOINTS_0 has to be unsigned byte or short, write a narrowed copy
+                jointsAccessor = self.exportJoints(builder, vertexBuffer, entry, vertexCount)
+                if jointsAccessor is not None:
+                    attributes["JOINTS_0"] = jointsAccessor
+                    continue
+            if entry.componentType not in gltfComponentTypes or entry.componentType == 5:
+                print("Skipping vertex buffer entry with unsupported componentType:", entry.name, entry.componentType)
+                continue
+            if entry.firstItemOffset % componentTypeSizes[entry.componentType]:
+                print("Skipping unaligned vertex buffer entry:", entry.name)
+                continue
+            morph = morphTargetName.fullmatch(entry.name.rstrip('\x00'))
+            if morph:
+                # pre version 7 morph targets are stored in the vertex buffer
+                semantic = gltfMorphSemantics.get(morph.group(1))
+                if semantic is None or entry.componentType != 10 or entry.numComponents < 3:
+                    print("Skipping morph target entry not representable in glTF:", entry.name)
+                    continue
+                accessor = {"bufferView": vertexView, "byteOffset": entry.firstItemOffset,
+                            "componentType": 5126, "count": vertexCount, "type": "VEC3"}
+                if semantic == "POSITION":
+                    accessor["min"], accessor["max"] = floatBounds(vertexBuffer.data, entry.firstItemOffset, stride, vertexCount, 3)
+                targets.setdefault(int(morph.group(2)), {})[semantic] = builder.addAccessor(accessor)
+                continue
+            if entry.numComponents not in gltfAccessorTypes:
+                print("Skipping vertex buffer entry with unsupported numComponents:", entry.name, entry.numComponents)
+                continue
+            semantic = gltfAttributeName(entry)
+            accessor = {"bufferView": vertexView, "byteOffset": entry.firstItemOffset,
+                        "componentType": gltfComponentTypes[entry.componentType],
+                        "count": vertexCount, "type": gltfAccessorTypes[entry.numComponents]}
+            if entry.componentType in (1, 3) and semantic in ("TEXCOORD_0", "TEXCOORD_1", "WEIGHTS_0", "COLOR_0"):
+                # the entry stays quantized on import instead of becoming float
+                accessor["normalized"] = True
+                accessor["extras"] = {"componentType": entry.componentType}
+            if semantic == "POSITION":
+                accessor["min"], accessor["max"] = floatBounds(vertexBuffer.data, entry.firstItemOffset, stride, vertexCount, 3)
+            attributes[semantic] = builder.addAccessor(accessor)
+
+        # version 7 morph targets, one block of vertexCount elements per entry
+        targetBuffer = mesh.targetBuffer
+        for entry in targetBuffer.entries:
+            morph = morphTargetName.fullmatch(entry.name.rstrip('\x00'))
+            semantic = gltfMorphSemantics.get(morph.group(1)) if morph else None
+            blockStride = entry.numComponents * 4
+            blockEnd = entry.firstItemOffset + vertexCount * blockStride
+            if semantic is None or entry.componentType != 10 or entry.numComponents < 3 or blockEnd > len(targetBuffer.data):
+                print("Skipping morph target entry not representable in glTF:", entry.name)
+                continue
+            targetView = builder.addBufferView(memoryview(targetBuffer.data)[entry.firstItemOffset:blockEnd], blockStride, ARRAY_BUFFER)
+            accessor = {"bufferView": targetView, "componentType": 5126, "count": vertexCount, "type": "VEC3"}
+            if semantic == "POSITION":
+                accessor["min"], accessor["max"] = floatBounds(targetBuffer.data[entry.firstItemOffset:blockEnd], 0, blockStride, vertexCount, 3)
+            targets.setdefault(int(morph.group(2)), {})[semantic] = builder.addAccessor(accessor)
+
+        # index buffer, every subset is a primitive pointing into the same bufferView
+        indexBuffer = mesh.indexBuffer
+        indexComponentType = indexBuffer.componentType
+        indexData = None
+        if len(indexBuffer.data) > 0 and indexComponentType in (3, 5):
+            indexData = memoryview(indexBuffer.data)
+            if flip:
+                indexData = packArray(flipWinding(unpackArray(indexBuffer.data, indexComponentType)))
+        elif flip:
+            # clockwise triangles without indices get a flipped index buffer
+            indexComponentType = 3 if vertexCount < 65535 else 5
+            indexData = packArray(flipWinding(array('H' if indexComponentType == 3 else 'I', range(vertexCount))))
+        indexView = None
+        if indexData is not None:
+            indexView = builder.addBufferView(indexData, None, ELEMENT_ARRAY_BUFFER)
+        indexSize = componentTypeSizes.get(indexComponentType, 4)
+
+        subsets = mesh.subsets
+        if len(subsets) == 0:
+            subset = Mesh.MeshSubset()
+            subset.count = len(indexData) // indexSize if indexView is not None else vertexCount
+            subsets = [subset]
+
+        primitives = []
+        lodIndex = 0
+        for subset in subsets:
+            primitive = {"attributes": attributes, "mode": gltfModes[mesh.drawMode]}
+            if indexView is not None and subset.count > 0:
+                primitive["indices"] = builder.addAccessor({
+                    "bufferView": indexView, "byteOffset": subset.offset * indexSize,
+                    "componentType": gltfComponentTypes[indexComponentType],
+                    "count": subset.count, "type": "SCALAR"})
+            if targets:
+                primitive["targets"] = [targets.get(index, {}) for index in range(max(targets) + 1)]
+            lods = mesh.lods[lodIndex:lodIndex + subset.lodCount]
+            lodIndex += subset.lodCount
+            primitive["extras"] = {
+                "name": subset.name,
+                "bounds": {
+                    "minimum": [subset.bounds.minimum['x'], subset.bounds.minimum['y'], subset.bounds.minimum['z']],
+                    "maximum": [subset.bounds.maximum['x'], subset.bounds.maximum['y'], subset.bounds.maximum['z']]
+                },
+                "lightmapSizeHint": [subset.lightmapSizeHintWidth, subset.lightmapSizeHintHeight],
+                "lods": [[lod.count, lod.offset, lod.distance] for lod in lods]
+            }
+            primitives.append(primitive)
+
+        builder.gltf["meshes"].append({
+            "name": "mesh" + str(meshId),
+            "primitives": primitives,
+            "extras": {"meshId": meshId, "winding": mesh.winding}
+        })
+        meshNode = {"name": "mesh" + str(meshId), "mesh": len(builder.gltf["meshes"]) - 1}
+
+        # joints become a skin with one node per joint
+        if len(mesh.joints) > 0:
+            jointNodes = []
+            inverseBindMatrices = []
+            for joint in mesh.joints:
+                jointNodes.append(builder.addNode({
+                    "name": "joint" + str(joint.jointId),
+                    "matrix": list(joint.localToGlobalBoneSpace),
+                    "extras": {"jointId": joint.jointId, "parentId": joint.parentId}
+                }))
+                inverseBindMatrices += joint.invBindPos
+            matricesView = builder.addBufferView(struct.pack("<" + str(len(inverseBindMatrices)) + "f", *inverseBindMatrices))
+            matricesAccessor = builder.addAccessor({"bufferView": matricesView, "componentType": 5126,
+                                                   "count": len(mesh.joints), "type": "MAT4"})
+            builder.gltf.setdefault("skins", []).append({"joints": jointNodes, "inverseBindMatrices": matricesAccessor})
+            meshNode["skin"] = len(builder.gltf["skins"]) - 1
+
+        builder.addNode(meshNode)
+        return True
+
+    def exportJoints(self, builder, vertexBuffer, entry, vertexCount):
+        # returns a JOINTS_0 accessor into a bufferView of its own, or None if
+        # the joint indices don't fit an unsigned short
+        componentType = entry.componentType
+        if componentType not in componentTypeCodes:
+            return None
+        size = componentTypeSizes[componentType]
+        if vertexBuffer.stride % size or entry.firstItemOffset % size:
+            return None
+        values = unpackArray(vertexBuffer.data[:vertexCount * vertexBuffer.stride], componentType)
+        step = vertexBuffer.stride // size
+        first = entry.firstItemOffset // size
+        columns = [values[first + component::step] for component in range(4)]
+        if any(not 0 <= value < 65536 or value != int(value) for column in columns for value in column):
+            return None
+        narrowType = 1 if max(max(column) for column in columns) < 256 else 3
+        joints = array(componentTypeCodes[narrowType], bytes(vertexCount * 4 * componentTypeSizes[narrowType]))
+        for component, column in enumerate(columns):
+            joints[component::4] = array(joints.typecode, map(int, column))
+        jointsView = builder.addBufferView(packArray(joints), 4 * componentTypeSizes[narrowType], ARRAY_BUFFER)
+        # the original entry is still in the vertex bufferView, import restores it from there
+        return builder.addAccessor({"bufferView": jointsView, "componentType": gltfComponentTypes[narrowType],
+                                    "count": vertexCount, "type": "VEC4",
+                                    "extras": {"componentType": componentType, "byteOffset": entry.firstItemOffset}})
+
+    def loadGlbFile(self, inputFile):
+        try:
+            with open(inputFile, "rb") as glbFile:
+                data = glbFile.read()
+            magic, version, length = struct.unpack_from("<III", data, 0)
+            if magic != GLB_MAGIC or version != 2:
+                print("File is not a glTF 2.0 binary file:", inputFile)
+                return
+            chunkLength, chunkType = struct.unpack_from("<II", data, 12)
+            if chunkType != GLB_JSON_CHUNK:
+                print("File is missing the glTF JSON chunk:", inputFile)
+                return
+            self.gltf = json.loads(bytes(data[20:20 + chunkLength]).decode('utf-8'))
+            binOffset = 20 + chunkLength
+            if binOffset + 8 <= min(length, len(data)):
+                binLength, binType = struct.unpack_from("<II", data, binOffset)
+                if binType == GLB_BIN_CHUNK:
+                    self.binData = memoryview(data)[binOffset + 8:binOffset + 8 + binLength]
+
+            # skins are attached to the nodes instantiating the meshes
+            meshSkins = {}
+            for node in self.gltf.get("nodes", []):
+                if "mesh" in node and "skin" in node:
+                    meshSkins.setdefault(node["mesh"], node["skin"])
+
+            for meshIndex, gltfMesh in enumerate(self.gltf.get("meshes", [])):
+                mesh = self.importMesh(gltfMesh, meshSkins.get(meshIndex))
+                if mesh is not None:
+                    meshId = gltfMesh.get("extras", {}).get("meshId", meshIndex)
+                    self.meshes[meshId] = mesh
+        except OSError:
+            print("Could not open/read file:", inputFile)
+        except (KeyError, IndexError, ValueError, struct.error) as error:
+            print("Invalid glTF file:", inputFile, error)
+
+    def accessorData(self, accessorIndex):
+        # returns (accessor, componentType, numComponents, byteStride, start in binData)
+        accessor = self.gltf["accessors"][accessorIndex]
+        if "bufferView" not in accessor or "sparse" in accessor:
+            raise ValueError("sparse or empty accessors are not supported")
+        bufferView = self.gltf["bufferViews"][accessor["bufferView"]]
+        if bufferView.get("buffer", 0) != 0:
+            raise ValueError("external buffers are not supported")
+        componentType = qtComponentTypes[accessor["componentType"]]
+        numComponents = gltfAccessorSizes[accessor["type"]]
+        elementSize = componentTypeSizes[componentType] * numComponents
+        byteStride = bufferView.get("byteStride", elementSize)
+        start = bufferView.get("byteOffset", 0) + accessor.get("byteOffset", 0)
+        return accessor, componentType, numComponents, byteStride, start
+
+    def buildVertexBuffer(self, attributes, interleave=False):
+        # returns a VertexBuffer for a primitive's attributes, or None
+        columns = []
+        # name -> already converted, tightly packed data for that column
+        sources = {}
+        vertexCount = None
+        for semantic in sorted(attributes):
+            name = qtAttributeName(semantic)
+            if name is None:
+                print("Skipping unsupported glTF attribute:", semantic)
+                continue
+            accessor, componentType, numComponents, byteStride, start = self.accessorData(attributes[semantic])
+            if vertexCount is None:
+                vertexCount = accessor["count"]
+            elif vertexCount != accessor["count"]:
+                raise ValueError("attribute counts do not match")
+            if semantic == "TANGENT":
+                # Qt Quick 3D tangents are vec3, the handedness in w goes into the binormal
+                if numComponents == 4 and "NORMAL" in attributes and "_attr_binormal" not in attributes:
+                    normal = self.floatColumns(*self.accessorData(attributes["NORMAL"]))
+                    tangent = self.floatColumns(accessor, componentType, numComponents, byteStride, start)
+                    binormal = scaleVec3(crossVec3(normal, tangent), tangent[3])
+                    sources["attr_binormal"] = packColumns(binormal, 'f')
+                    columns.append(("attr_binormal", None, 10, 3, 12, 0, None))
+                numComponents = 3
+            # joints narrowed on export remember their original componentType
+            widenType = None
+            if semantic == "JOINTS_0" and numComponents == 4:
+                widenType = accessor.get("extras", {}).get("componentType")
+                if widenType not in componentTypeCodes:
+                    widenType = None
+            if accessor.get("normalized") and componentType != accessor.get("extras", {}).get("componentType"):
+                # Mesh entries have no normalized flag, quantized attributes become float
+                sources[name] = packColumns(self.floatColumns(accessor, componentType, numComponents, byteStride, start), 'f')
+                componentType, byteStride = 10, 4 * numComponents
+            columns.append((name, accessor, componentType, numComponents, byteStride, start, widenType))
+        vertexBuffer = Mesh.VertexBuffer()
+        if not columns:
+            return None
+
+        def columnOffset(column):
+            if column[6] is not None:
+                return column[1]["extras"].get("byteOffset", -1)
+            return column[1].get("byteOffset", 0)
+
+        # narrowed joints don't count, their original entry is in the interleaved bufferView
+        packed = [column for column in columns if column[6] is None and column[0] not in sources]
+        views = set(column[1]["bufferView"] for column in packed)
+        viewStride = packed[0][4] if packed else 0
+        sharedView = not sources and len(views) == 1 and all(column[4] == viewStride for column in packed)
+        sharedView = sharedView and all(0 <= columnOffset(column) <= viewStride - componentTypeSizes[column[6] or column[2]] * column[3] for column in columns)
+        if sharedView and not interleave and viewStride % 4 == 0:
+            # already interleaved, take the bufferView as is
+            bufferView = self.gltf["bufferViews"][views.pop()]
+            viewStart = bufferView.get("byteOffset", 0)
+            data = bytes(self.binData[viewStart:viewStart + vertexCount * viewStride])
+            data += bytes(vertexCount * viewStride - len(data))
+            vertexBuffer.stride = viewStride
+            columns.sort(key=columnOffset)
+            for column in columns:
+                entry = Mesh.VertexBufferEntry()
+                entry.name = column[0] + '\x00'
+                entry.componentType = column[6] or column[2]
+                entry.numComponents = column[3]
+                entry.firstItemOffset = columnOffset(column)
+                vertexBuffer.entries.append(entry)
+            vertexBuffer.data = data
+            return vertexBuffer
+
+        # interleave with one strided copy per byte column
+        stride = 0
+        for name, accessor, componentType, numComponents, byteStride, start, widenType in columns:
+            entry = Mesh.VertexBufferEntry()
+            entry.name = name + '\x00'
+            entry.componentType = widenType or componentType
+            entry.numComponents = numComponents
+            entry.firstItemOffset = stride
+            vertexBuffer.entries.append(entry)
+            elementSize = componentTypeSizes[entry.componentType] * numComponents
+            stride += elementSize + (4 - elementSize % 4) % 4
+        data = bytearray(vertexCount * stride)
+        for entry, column in zip(vertexBuffer.entries, columns):
+            componentType, byteStride, start, widenType = column[2], column[4], column[5], column[6]
+            elementSize = componentTypeSizes[entry.componentType] * entry.numComponents
+            if entry.name[:-1] in sources:
+                source, byteStride = sources[entry.name[:-1]], elementSize
+            elif widenType is not None:
+                # widen the narrowed joints back to their original componentType
+                joints = self.accessorColumns(componentType, 4, byteStride, start, vertexCount)
+                source, byteStride = packColumns(joints, componentTypeCodes[widenType]), elementSize
+            else:
+                source = bytes(self.binData[start:start + (vertexCount - 1) * byteStride + elementSize])
+            for byte in range(elementSize):
+                data[entry.firstItemOffset + byte::stride] = source[byte::byteStride]
+        vertexBuffer.stride = stride
+        vertexBuffer.data = bytes(data)
+        return vertexBuffer
+
+    def accessorColumns(self, componentType, numComponents, byteStride, start, count):
+        # one array per component, unpacked in one go and split with strided slices
+        size = componentTypeSizes[componentType]
+        values = unpackArray(self.binData[start:start + (count - 1) * byteStride + numComponents * size], componentType)
+        return [values[component::byteStride // size] for component in range(numComponents)]
+
+    def floatColumns(self, accessor, componentType, numComponents, byteStride, start):
+        columns = self.accessorColumns(componentType, numComponents, byteStride, start, accessor["count"])
+        if accessor.get("normalized") and componentType in normalizedScales:
+            scale = normalizedScales[componentType]
+            columns = [list(map(max, map(truediv, column, repeat(scale)), repeat(-1.0))) for column in columns]
+        return columns
+
+    def indexArray(self, accessorIndex, componentType):
+        accessor, sourceType, numComponents, byteStride, start = self.accessorData(accessorIndex)
+        size = componentTypeSizes[sourceType]
+        indexes = unpackArray(self.binData[start:start + accessor["count"] * size], sourceType)
+        if indexes.typecode != ('H' if componentType == 3 else 'I'):
+            indexes = array('H' if componentType == 3 else 'I', indexes)
+        return indexes
+
+    def importMesh(self, gltfMesh, skinIndex):
+        primitives = gltfMesh.get("primitives", [])
+        if not primitives:
+            return None
+        mode = primitives[0].get("mode", 4)
+        if mode not in qtDrawModes:
+            print("Skipping glTF mesh with unsupported mode:", mode)
+            return None
+        usable = []
+        for primitive in primitives:
+            if primitive.get("mode", 4) != mode:
+                print("Skipping glTF primitive with a different mode:", primitive.get("mode", 4))
+                continue
+            usable.append(primitive)
+        primitives = usable
+
+        mesh = Mesh()
+        mesh.meshInfo.fileId = 3365961549
+        mesh.meshInfo.fileVersion = 6
+        mesh.drawMode = qtDrawModes[mode]
+        mesh.winding = gltfMesh.get("extras", {}).get("winding", 2)
+        # clockwise meshes were exported with flipped triangles, flip them back
+        flip = mesh.winding == 1 and mesh.drawMode == 7
+
+        attributes = primitives[0]["attributes"]
+        sharedAttributes = all(primitive["attributes"] == attributes for primitive in primitives)
+        indexAccessors = [primitive.get("indices") for primitive in primitives]
+
+        if sharedAttributes:
+            mesh.vertexBuffer = self.buildVertexBuffer(attributes)
+            if mesh.vertexBuffer is None:
+                return None
+            vertexCount = len(mesh.vertexBuffer.data) // mesh.vertexBuffer.stride
+            indexViews = set()
+            for accessorIndex in indexAccessors:
+                if accessorIndex is None:
+                    break
+                accessor = self.gltf["accessors"][accessorIndex]
+                indexViews.add((accessor.get("bufferView"), accessor["componentType"]))
+            if len(indexViews) == 1 and all(accessorIndex is not None for accessorIndex in indexAccessors):
+                bufferViewIndex, gltfComponentType = indexViews.pop()
+                bufferView = self.gltf["bufferViews"][bufferViewIndex]
+                if gltfComponentType in (5123, 5125) and "byteStride" not in bufferView:
+                    # one index bufferView shared by all primitives, take it as is
+                    viewStart = bufferView.get("byteOffset", 0)
+                    mesh.indexBuffer.componentType = qtComponentTypes[gltfComponentType]
+                    mesh.indexBuffer.data = bytes(self.binData[viewStart:viewStart + bufferView["byteLength"]])
+                    if flip:
+                        mesh.indexBuffer.data = packArray(flipWinding(unpackArray(mesh.indexBuffer.data, mesh.indexBuffer.componentType)))
+                    indexSize = componentTypeSizes[mesh.indexBuffer.componentType]
+                    for primitive in primitives:
+                        accessor = self.gltf["accessors"][primitive["indices"]]
+                        self.addSubset(mesh, primitive, accessor.get("byteOffset", 0) // indexSize, accessor["count"], True)
+                    self.importMorphTargets(mesh, primitives[0], vertexCount)
+                    self.importSkin(mesh, skinIndex)
+                    return mesh
+            vertexBuffers = [(mesh.vertexBuffer, primitive) for primitive in primitives]
+        else:
+            # every primitive has its own vertices, concatenate them
+            vertexBuffers = []
+            for primitive in primitives:
+                vertexBuffer = self.buildVertexBuffer(primitive["attributes"], True)
+                if vertexBuffer is None:
+                    continue
+                if vertexBuffers:
+                    layout = [(entry.name, entry.componentType, entry.numComponents) for entry in vertexBuffers[0][0].entries]
+                    if layout != [(entry.name, entry.componentType, entry.numComponents) for entry in vertexBuffer.entries]:
+                        print("Skipping glTF primitive with a different vertex layout")
+                        continue
+                vertexBuffers.append((vertexBuffer, primitive))
+            if not vertexBuffers:
+                return None
+            mesh.vertexBuffer = Mesh.VertexBuffer()
+            mesh.vertexBuffer.entries = vertexBuffers[0][0].entries
+            mesh.vertexBuffer.stride = vertexBuffers[0][0].stride
+            mesh.vertexBuffer.data = b''.join(vertexBuffer.data for vertexBuffer, primitive in vertexBuffers)
+            if any(primitive.get("targets") for vertexBuffer, primitive in vertexBuffers):
+                print("Morph targets of glTF meshes with separate primitive vertices are not imported")
+
+        # build a new index buffer, rebasing indices when vertices were concatenated
+        stride = mesh.vertexBuffer.stride
+        componentType = 3 if len(mesh.vertexBuffer.data) // stride < 65535 else 5
+        indexes = array('H' if componentType == 3 else 'I')
+        vertexBase = 0
+        for vertexBuffer, primitive in vertexBuffers:
+            vertexCount = len(vertexBuffer.data) // stride
+            if primitive.get("indices") is not None:
+                primitiveIndexes = self.indexArray(primitive["indices"], componentType)
+                if vertexBase:
+                    primitiveIndexes = array(primitiveIndexes.typecode, (index + vertexBase for index in primitiveIndexes))
+            else:
+                primitiveIndexes = array(indexes.typecode, range(vertexBase, vertexBase + vertexCount))
+            if flip:
+                primitiveIndexes = flipWinding(primitiveIndexes)
+            self.addSubset(mesh, primitive, len(indexes), len(primitiveIndexes), False)
+            indexes += primitiveIndexes
+            if not sharedAttributes:
+                vertexBase += vertexCount
+        mesh.indexBuffer.componentType = componentType
+        mesh.indexBuffer.data = packArray(indexes)
+        if sharedAttributes:
+            self.importMorphTargets(mesh, primitives[0], len(mesh.vertexBuffer.data) // stride)
+        self.importSkin(mesh, skinIndex)
+        return mesh
+
+    def addSubset(self, mesh, primitive, offset, count, keepLods):
+        extras = primitive.get("extras", {})
+        subset = Mesh.MeshSubset()
+        subset.offset = offset
+        subset.count = count
+        subset.name = extras.get("name", "")
+        subset.nameLength = len(subset.name)
+        if "bounds" in extras:
+            minimum, maximum = extras["bounds"]["minimum"], extras["bounds"]["maximum"]
+        else:
+            position = self.gltf["accessors"][primitive["attributes"]["POSITION"]] if "POSITION" in primitive["attributes"] else {}
+            minimum, maximum = position.get("min", [0.0, 0.0, 0.0]), position.get("max", [0.0, 0.0, 0.0])
+        subset.bounds.minimum = {'x': minimum[0], 'y': minimum[1], 'z': minimum[2]}
+        subset.bounds.maximum = {'x': maximum[0], 'y': maximum[1], 'z': maximum[2]}
+        subset.lightmapSizeHintWidth, subset.lightmapSizeHintHeight = extras.get("lightmapSizeHint", [0, 0])
+        # lod offsets are only meaningful when the index buffer was kept as is
+        if keepLods:
+            for count, offset, distance in extras.get("lods", []):
+                lod = Mesh.Lod()
+                lod.count = count
+                lod.offset = offset
+                lod.distance = distance
+                mesh.lods.append(lod)
+                subset.lodCount += 1
+        elif extras.get("lods"):
+            print("Dropping lods of glTF primitive:", subset.name)
+        mesh.subsets.append(subset)
+
+    def importMorphTargets(self, mesh, primitive, vertexCount):
+        # morph targets go to the version 7 target buffer as vec4 blocks
+        targetData = bytearray()
+        # keep the order the blocks have in the BIN chunk, that is the order of
+        # the entries in the target buffer this was exported from
+        targetAccessors = []
+        for targetIndex, target in enumerate(primitive.get("targets", [])):
+            for semantic, accessorIndex in target.items():
+                if semantic not in qtMorphNames:
+                    print("Skipping unsupported glTF morph target attribute:", semantic)
+                    continue
+                accessor, componentType, numComponents, byteStride, start = self.accessorData(accessorIndex)
+                if componentType != 10 or accessor["count"] != vertexCount:
+                    print("Skipping unsupported glTF morph target accessor:", semantic)
+                    continue
+                targetAccessors.append((start, targetIndex, semantic, accessor, byteStride))
+        targetAccessors.sort(key=lambda targetAccessor: targetAccessor[:3])
+        for start, targetIndex, semantic, accessor, byteStride in targetAccessors:
+            # a dedicated vec4 bufferView (as exported from a target buffer) is kept whole
+            bufferView = self.gltf["bufferViews"][accessor["bufferView"]]
+            copySize = 16 if byteStride == 16 and bufferView["byteLength"] == vertexCount * 16 else 12
+            block = bytearray(vertexCount * 16)
+            source = bytes(self.binData[start:start + (vertexCount - 1) * byteStride + copySize])
+            for byte in range(copySize):
+                block[byte::16] = source[byte::byteStride]
+            entry = Mesh.VertexBufferEntry()
+            entry.name = "attr_t" + qtMorphNames[semantic] + str(targetIndex) + '\x00'
+            entry.componentType = 10
+            entry.numComponents = 4
+            entry.firstItemOffset = len(targetData)
+            mesh.targetBuffer.entries.append(entry)
+            targetData += block
+        if mesh.targetBuffer.entries:
+            mesh.targetBuffer.numTargets = len(primitive["targets"])
+            mesh.targetBuffer.data = bytes(targetData)
+            mesh.meshInfo.fileVersion = 7
+
+    def importSkin(self, mesh, skinIndex):
+        if skinIndex is None:
+            return
+        skin = self.gltf["skins"][skinIndex]
+        nodes = self.gltf.get("nodes", [])
+        parents = {}
+        for nodeIndex, node in enumerate(nodes):
+            for child in node.get("children", []):
+                parents[child] = nodeIndex
+        jointIndexes = {nodeIndex: jointIndex for jointIndex, nodeIndex in enumerate(skin["joints"])}
+        matrices = None
+        if "inverseBindMatrices" in skin:
+            accessor, componentType, numComponents, byteStride, start = self.accessorData(skin["inverseBindMatrices"])
+            matrices = unpackArray(self.binData[start:start + accessor["count"] * 64], 10)
+        for jointIndex, nodeIndex in enumerate(skin["joints"]):
+            node = nodes[nodeIndex]
+            extras = node.get("extras", {})
+            joint = Mesh.Joint()
+            joint.jointId = extras.get("jointId", jointIndex)
+            joint.parentId = extras.get("parentId", jointIndexes.get(parents.get(nodeIndex), 0))
+            if matrices is not None:
+                joint.invBindPos = list(matrices[jointIndex * 16:jointIndex * 16 + 16])
+            if "matrix" in node:
+                joint.localToGlobalBoneSpace = list(node["matrix"])
+            mesh.joints.append(joint)
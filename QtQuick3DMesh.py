@@ -30,12 +30,76 @@
 #############################################################################
 
 import sys
+import copy
+import math
 import struct
+import hashlib
+from array import array
+from itertools import repeat
+from operator import add, sub, mul, truediv, itemgetter
+
+# array typecodes and byte sizes for the componentType enum
+# (float16 has no array typecode, so it can only be handled through struct)
+componentTypeCodes = {1: 'B', 2: 'b', 3: 'H', 4: 'h', 5: 'I', 6: 'i', 7: 'Q', 8: 'q', 10: 'f', 11: 'd'}
+componentTypeSizes = {1: 1, 2: 1, 3: 2, 4: 2, 5: 4, 6: 4, 7: 8, 8: 8, 9: 2, 10: 4, 11: 8}
 
 def alignmentHelper(size):
     #intentionally stupid to match file format
     return bytearray(4 - size % 4)
 
+def unpackArray(data, componentType):
+    # bulk unpack of little endian data into an array (no per element struct calls)
+    values = array(componentTypeCodes[componentType])
+    values.frombytes(data[:len(data) - len(data) % values.itemsize])
+    if sys.byteorder == 'big':
+        values.byteswap()
+    return values
+
+def packArray(values):
+    # inverse of unpackArray, returns little endian bytes
+    if sys.byteorder == 'big':
+        values = array(values.typecode, values)
+        values.byteswap()
+    return values.tobytes()
+
+# Column helpers, a vec3 column is a tuple of (x, y, z) sequences. The math
+# is done with map() over whole columns instead of looping per vertex.
+def gatherColumn(values, indexes):
+    if len(indexes) == 0:
+        return []
+    if len(indexes) == 1:
+        return [values[indexes[0]]]
+    return itemgetter(*indexes)(values)
+
+def gatherVec3(columns, indexes):
+    return tuple(gatherColumn(column, indexes) for column in columns)
+
+def subVec3(a, b):
+    return tuple(list(map(sub, a[i], b[i])) for i in range(3))
+
+def scaleVec3(a, scale):
+    return tuple(list(map(mul, a[i], scale)) for i in range(3))
+
+def dotVec3(a, b):
+    return list(map(add, map(add, map(mul, a[0], b[0]), map(mul, a[1], b[1])), map(mul, a[2], b[2])))
+
+def crossVec3(a, b):
+    return (list(map(sub, map(mul, a[1], b[2]), map(mul, a[2], b[1]))),
+            list(map(sub, map(mul, a[2], b[0]), map(mul, a[0], b[2]))),
+            list(map(sub, map(mul, a[0], b[1]), map(mul, a[1], b[0]))))
+
+def lengthVec3(a):
+    return list(map(math.hypot, a[0], a[1], a[2]))
+
+def normalizeVec3(a):
+    # zero length vectors stay zero
+    lengths = [length or 1.0 for length in lengthVec3(a)]
+    return tuple(list(map(truediv, a[i], lengths)) for i in range(3))
+
+def scatterAdd(target, indexes, values):
+    for index, value in zip(indexes, values):
+        target[index] += value
+
 class Mesh:
     class MeshDataHeader:
         def __init__(self):
@@ -175,6 +239,53 @@ class Mesh:
                     else:
                         self.morphTargets[entry.name].append(value)
 
+        def vertexCount(self):
+            return len(self.data) // self.stride if self.stride else 0
+
+        def findEntry(self, name):
+            for entry in self.entries:
+                if entry.name.rstrip('\x00') == name:
+                    return entry
+            return None
+
+        def floatColumns(self, entry):
+            # one array per component of a float32 entry, sliced out of the interleaved data
+            if entry.componentType != 10 or self.stride % 4 or entry.firstItemOffset % 4:
+                return None
+            values = unpackArray(self.data[:self.vertexCount() * self.stride], 10)
+            step = self.stride // 4
+            first = entry.firstItemOffset // 4
+            return tuple(values[first + component::step] for component in range(entry.numComponents))
+
+        def appendFloatEntries(self, attributes):
+            # attributes is a list of (name, columns), every column holds one
+            # float32 component per vertex. The stride is widened and the
+            # interleaved data is repacked in one pass of strided slice copies.
+            count = self.vertexCount()
+            stride = self.stride + sum(4 * len(columns) for name, columns in attributes)
+            data = bytearray(count * stride)
+            for byte in range(self.stride):
+                data[byte::stride] = self.data[byte:count * self.stride:self.stride]
+            firstItemOffset = self.stride
+            for name, columns in attributes:
+                numComponents = len(columns)
+                values = array('f', bytes(4 * count * numComponents))
+                for component in range(numComponents):
+                    values[component::numComponents] = array('f', columns[component])
+                packed = packArray(values)
+                elementSize = 4 * numComponents
+                for byte in range(elementSize):
+                    data[firstItemOffset + byte::stride] = packed[byte::elementSize]
+                entry = Mesh.VertexBufferEntry()
+                entry.name = name + '\x00'
+                entry.componentType = 10
+                entry.numComponents = numComponents
+                entry.firstItemOffset = firstItemOffset
+                self.entries.append(entry)
+                firstItemOffset += elementSize
+            self.stride = stride
+            self.data = bytes(data)
+
         def vertices(self):
             vertices = []
             # vertices is a list of dictionaries containing all enrties for that index
@@ -208,15 +319,17 @@ class Mesh:
                     indexes.append(index)
 
             return indexes
+        def indexArray(self):
+            # array backed alternative to indexes()
+            if self.componentType not in (3, 5):
+                return array('I')
+            return unpackArray(self.data, self.componentType)
         def setIndexes(self, indexArray, componentType):
             # this method packs the data buffer from an array of ints
-            type = "<I"
+            type = "I"
             if componentType == 3:
-                type = "<H"
-            data = bytearray()
-            for index in indexArray:
-                data += struct.pack(type, index)
-            self.data = data
+                type = "H"
+            self.data = packArray(array(type, indexArray))
             self.componentType = componentType
 
     class TargetBuffer:
@@ -421,9 +534,9 @@ class Mesh:
                         targetBufferEntry.firstItemOffset, = struct.unpack("<I", meshFile.read(4));
                         entriesByteSize += 16
                         self.targetBuffer.entries.append(targetBufferEntry)
-                        # align after reading entries
-                        offsetTracker.alignedAdvance(entriesByteSize)
-                        meshFile.seek(offsetTracker.offset())
+                    # align after reading entries
+                    offsetTracker.alignedAdvance(entriesByteSize)
+                    meshFile.seek(offsetTracker.offset())
                     # Entry Names
                     for entry in self.targetBuffer.entries:
                         nameLength, = struct.unpack("<I", meshFile.read(4))
@@ -444,153 +557,167 @@ class Mesh:
             print("Could not open/read file:", inputFile)
         except: #handle other exceptions such as attribute errors
             print("Unexpected error:", sys.exc_info()[0])
-    def writeMesh(self, outputFile, offset):
-        try:
-            with open(outputFile, "wb") as meshFile:
-                # write header placeholder
-                meshFile.seek(offset, 0)
-                if self.meshInfo.fileVersion < 7:
-                    self.meshInfo.fileVersion = 6
-                else:
-                    self.meshInfo.fileVersion = 7 # current version is 7
-                header,headerSize = self.meshInfo.save()
-                meshFile.write(header)
-                offsetTracker = self.MeshOffsetTracker(headerSize)
-                # write Mesh metadata
-                meshMetaData = bytearray()
-                if self.meshInfo.fileVersion < 7:
-                    meshMetaData += struct.pack("<I", 0)
-                else:
-                    meshMetaData += struct.pack("<I", len(self.targetBuffer.entries))
-                meshMetaData += struct.pack("<I", len(self.vertexBuffer.entries))
-                meshMetaData += struct.pack("<I", self.vertexBuffer.stride)
-                if self.meshInfo.fileVersion < 7:
-                    meshMetaData += struct.pack("<I", 0)
-                else:
-                    meshMetaData += struct.pack("<I", len(self.targetBuffer.data))
-                meshMetaData += struct.pack("<I", len(self.vertexBuffer.data))
-
-                meshMetaData += struct.pack("<I", self.indexBuffer.componentType)
-                meshMetaData += struct.pack("<I", 0)
-                meshMetaData += struct.pack("<I", len(self.indexBuffer.data))
-
-                if self.meshInfo.fileVersion < 7:
-                    meshMetaData += struct.pack("<I", 0) # if version < 7
-                else:
-                    meshMetaData += struct.pack("<I", self.targetBuffer.numTargets)
-                meshMetaData += struct.pack("<I", len(self.subsets))
-
-                meshMetaData += struct.pack("<I", 0)
-                meshMetaData += struct.pack("<I", len(self.joints))
-
-                meshMetaData += struct.pack("<I", self.drawMode)
-                meshMetaData += struct.pack("<I", self.winding)
+    def saveMesh(self):
+        # serializes the mesh (header included) and returns the bytes
+        if self.meshInfo.fileVersion < 7:
+            self.meshInfo.fileVersion = 6
+        else:
+            self.meshInfo.fileVersion = 7 # current version is 7
+        header,headerSize = self.meshInfo.save()
+        meshData = bytearray(header)
+        offsetTracker = self.MeshOffsetTracker(headerSize)
+        # write Mesh metadata
+        meshMetaData = bytearray()
+        if self.meshInfo.fileVersion < 7:
+            meshMetaData += struct.pack("<I", 0)
+        else:
+            meshMetaData += struct.pack("<I", len(self.targetBuffer.entries))
+        meshMetaData += struct.pack("<I", len(self.vertexBuffer.entries))
+        meshMetaData += struct.pack("<I", self.vertexBuffer.stride)
+        if self.meshInfo.fileVersion < 7:
+            meshMetaData += struct.pack("<I", 0)
+        else:
+            meshMetaData += struct.pack("<I", len(self.targetBuffer.data))
+        meshMetaData += struct.pack("<I", len(self.vertexBuffer.data))
 
-                meshFile.write(meshMetaData)
-                offsetTracker.advance(56)
+        meshMetaData += struct.pack("<I", self.indexBuffer.componentType)
+        meshMetaData += struct.pack("<I", 0)
+        meshMetaData += struct.pack("<I", len(self.indexBuffer.data))
 
-                # Vertex Buffer Entries
-                entriesData = bytearray()
-                for entry in self.vertexBuffer.entries:
-                    entriesData += struct.pack("<I", 0)
-                    entriesData += struct.pack("<I", entry.componentType)
-                    entriesData += struct.pack("<I", entry.numComponents)
-                    entriesData += struct.pack("<I", entry.firstItemOffset)
-                entriesData += alignmentHelper(len(entriesData)) # alignment
-                offsetTracker.advance(len(entriesData))
-                meshFile.write(entriesData)
-
-                # Vertex Buffer Entry Names
-                entryNameData = bytearray()
-                for entry in self.vertexBuffer.entries:
-                    entryNameData += struct.pack("<I", len(entry.name))
-                    entryNameData += bytearray(entry.name, 'utf-8')
-                    entryNameData += alignmentHelper(len(entry.name))
-                meshFile.write(entryNameData)
-                offsetTracker.advance(len(entryNameData))
-
-                # write vertex buffer data
-                meshFile.write(self.vertexBuffer.data)
-                meshFile.write(alignmentHelper(len(self.vertexBuffer.data)))
-                offsetTracker.alignedAdvance(len(self.vertexBuffer.data))
-                # write index buffer data
-                meshFile.write(self.indexBuffer.data)
-                meshFile.write(alignmentHelper(len(self.indexBuffer.data)))
-                offsetTracker.alignedAdvance(len(self.indexBuffer.data))
-
-                # subsets
-                subsetsData = bytearray()
-                for subset in self.subsets:
-                    subsetsData += struct.pack("<I", subset.count)
-                    subsetsData += struct.pack("<I", subset.offset)
-                    subsetsData += struct.pack("<f", subset.bounds.minimum["x"])
-                    subsetsData += struct.pack("<f", subset.bounds.minimum["y"])
-                    subsetsData += struct.pack("<f", subset.bounds.minimum["z"])
-                    subsetsData += struct.pack("<f", subset.bounds.maximum["x"])
-                    subsetsData += struct.pack("<f", subset.bounds.maximum["y"])
-                    subsetsData += struct.pack("<f", subset.bounds.maximum["z"])
-                    subsetsData += struct.pack("<I", 0) # offset
-                    subsetsData += struct.pack("<I", subset.nameLength)
-                    subsetsData += struct.pack("<I", subset.lightmapSizeHintWidth)
-                    subsetsData += struct.pack("<I", subset.lightmapSizeHintHeight)
-                    subsetsData += struct.pack("<I", subset.lodCount)
-                subsetsData += alignmentHelper(len(subsetsData)) # alignment
-                offsetTracker.advance(len(subsetsData))
-                meshFile.write(subsetsData)
-
-                # subsets names
-                subsetNameData = bytearray()
-                for subset in self.subsets:
-                    subsetNameData += bytearray(subset.name, 'utf-16le')
-                    subsetNameData += alignmentHelper(subset.nameLength * 2)
-                meshFile.write(subsetNameData)
-                offsetTracker.advance(len(subsetNameData))
-
-                # lods
-                lodData = bytearray()
-                for lod in self.lods:
-                    lodData += struct.pack("<I", lod.count)
-                    lodData += struct.pack("<I", lod.offset)
-                    lodData += struct.pack("<f", lod.distance)
-                meshFile.write(lodData)
-                lodData += alignmentHelper(len(lodData))
-                offsetTracker.advance(len(lodData))
-
-                if self.meshInfo.fileVersion >= 7:
-                    # target buffer entires
-                    targetEntriesData = bytearray()
-                    for entry in self.targetBuffer.entries:
-                        targetEntriesData += struct.pack("<I", 0)
-                        targetEntriesData += struct.pack("<I", entry.componentType)
-                        targetEntriesData += struct.pack("<I", entry.numComponents)
-                        targetEntriesData += struct.pack("<I", entry.firstItemOffset)
-                    targetEntriesData += alignmentHelper(len(targetEntriesData)) # alignment
-                    offsetTracker.advance(len(targetEntriesData))
-                    meshFile.write(targetEntriesData)
-
-                    # target buffer entry names
-                    targetEntryNameData = bytearray()
-                    for entry in self.targetBuffer.entries:
-                        targetEntryNameData += struct.pack("<I", len(entry.name))
-                        targetEntryNameData += bytearray(entry.name, 'utf-8')
-                        targetEntryNameData += alignmentHelper(len(entry.name))
-                    meshFile.write(targetEntryNameData)
-                    offsetTracker.advance(len(targetEntryNameData))
-
-                    # target buffer data
-                    meshFile.write(self.targetBuffer.data)
-                    meshFile.write(alignmentHelper(len(self.targetBuffer.data)))
-                    offsetTracker.alignedAdvance(len(self.targetBuffer.data))
-
-                # Now that we know the final size of the mesh, we need to write
-                # the header again with the correct size
+        if self.meshInfo.fileVersion < 7:
+            meshMetaData += struct.pack("<I", 0) # if version < 7
+        else:
+            meshMetaData += struct.pack("<I", self.targetBuffer.numTargets)
+        meshMetaData += struct.pack("<I", len(self.subsets))
+
+        meshMetaData += struct.pack("<I", 0)
+        meshMetaData += struct.pack("<I", len(self.joints))
+
+        meshMetaData += struct.pack("<I", self.drawMode)
+        meshMetaData += struct.pack("<I", self.winding)
+
+        meshData += meshMetaData
+        offsetTracker.advance(56)
+
+        # Vertex Buffer Entries
+        entriesData = bytearray()
+        for entry in self.vertexBuffer.entries:
+            entriesData += struct.pack("<I", 0)
+            entriesData += struct.pack("<I", entry.componentType)
+            entriesData += struct.pack("<I", entry.numComponents)
+            entriesData += struct.pack("<I", entry.firstItemOffset)
+        entriesData += alignmentHelper(len(entriesData)) # alignment
+        offsetTracker.advance(len(entriesData))
+        meshData += entriesData
+
+        # Vertex Buffer Entry Names
+        entryNameData = bytearray()
+        for entry in self.vertexBuffer.entries:
+            entryNameData += struct.pack("<I", len(entry.name))
+            entryNameData += bytearray(entry.name, 'utf-8')
+            entryNameData += alignmentHelper(len(entry.name))
+        meshData += entryNameData
+        offsetTracker.advance(len(entryNameData))
+
+        # write vertex buffer data
+        meshData += self.vertexBuffer.data
+        meshData += alignmentHelper(len(self.vertexBuffer.data))
+        offsetTracker.alignedAdvance(len(self.vertexBuffer.data))
+        # write index buffer data
+        meshData += self.indexBuffer.data
+        meshData += alignmentHelper(len(self.indexBuffer.data))
+        offsetTracker.alignedAdvance(len(self.indexBuffer.data))
+
+        # subsets
+        subsetsData = bytearray()
+        for subset in self.subsets:
+            subsetsData += struct.pack("<I", subset.count)
+            subsetsData += struct.pack("<I", subset.offset)
+            subsetsData += struct.pack("<f", subset.bounds.minimum["x"])
+            subsetsData += struct.pack("<f", subset.bounds.minimum["y"])
+            subsetsData += struct.pack("<f", subset.bounds.minimum["z"])
+            subsetsData += struct.pack("<f", subset.bounds.maximum["x"])
+            subsetsData += struct.pack("<f", subset.bounds.maximum["y"])
+            subsetsData += struct.pack("<f", subset.bounds.maximum["z"])
+            subsetsData += struct.pack("<I", 0) # offset
+            subsetsData += struct.pack("<I", subset.nameLength)
+            subsetsData += struct.pack("<I", subset.lightmapSizeHintWidth)
+            subsetsData += struct.pack("<I", subset.lightmapSizeHintHeight)
+            subsetsData += struct.pack("<I", subset.lodCount)
+        subsetsData += alignmentHelper(len(subsetsData)) # alignment
+        offsetTracker.advance(len(subsetsData))
+        meshData += subsetsData
+
+        # subsets names
+        subsetNameData = bytearray()
+        for subset in self.subsets:
+            subsetNameData += bytearray(subset.name, 'utf-16le')
+            subsetNameData += alignmentHelper(subset.nameLength * 2)
+        meshData += subsetNameData
+        offsetTracker.advance(len(subsetNameData))
+
+        # lods
+        lodData = bytearray()
+        for lod in self.lods:
+            lodData += struct.pack("<I", lod.count)
+            lodData += struct.pack("<I", lod.offset)
+            lodData += struct.pack("<f", lod.distance)
+        lodData += alignmentHelper(len(lodData))
+        meshData += lodData
+        offsetTracker.advance(len(lodData))
+
+        # joints
+        jointData = bytearray()
+        for joint in self.joints:
+            jointData += struct.pack("<I", joint.jointId)
+            jointData += struct.pack("<I", joint.parentId)
+            jointData += struct.pack("<16f", *joint.invBindPos)
+            jointData += struct.pack("<16f", *joint.localToGlobalBoneSpace)
+        meshData += jointData
+        offsetTracker.advance(len(jointData))
+
+        if self.meshInfo.fileVersion >= 7:
+            # target buffer entires
+            targetEntriesData = bytearray()
+            for entry in self.targetBuffer.entries:
+                targetEntriesData += struct.pack("<I", 0)
+                targetEntriesData += struct.pack("<I", entry.componentType)
+                targetEntriesData += struct.pack("<I", entry.numComponents)
+                targetEntriesData += struct.pack("<I", entry.firstItemOffset)
+            targetEntriesData += alignmentHelper(len(targetEntriesData)) # alignment
+            offsetTracker.advance(len(targetEntriesData))
+            meshData += targetEntriesData
+
+            # target buffer entry names
+            targetEntryNameData = bytearray()
+            for entry in self.targetBuffer.entries:
+                targetEntryNameData += struct.pack("<I", len(entry.name))
+                targetEntryNameData += bytearray(entry.name, 'utf-8')
+                targetEntryNameData += alignmentHelper(len(entry.name))
+            meshData += targetEntryNameData
+            offsetTracker.advance(len(targetEntryNameData))
+
+            # target buffer data
+            meshData += self.targetBuffer.data
+            meshData += alignmentHelper(len(self.targetBuffer.data))
+            offsetTracker.alignedAdvance(len(self.targetBuffer.data))
+
+        # Now that we know the final size of the mesh, we need to write
+        # the header again with the correct size
+        self.meshInfo.sizeInBytes = offsetTracker.byteCounter
+        header,headerSize = self.meshInfo.save()
+        meshData[0:headerSize] = header
+        return meshData
+    def writeMesh(self, outputFile, offset):
+        try:
+            meshData = self.saveMesh()
+            # only truncate for the first mesh, following meshes of a
+            # MultiMesh container are written behind the previous ones
+            with open(outputFile, "wb" if offset == 0 else "r+b") as meshFile:
                 meshFile.seek(offset, 0)
-                self.meshInfo.sizeInBytes = offsetTracker.offset() - headerSize
-                header,headerSize = self.meshInfo.save()
-                meshFile.write(header)
-
+                meshFile.write(meshData)
                 meshFile.close()
-                return offsetTracker.offset()
+                return offset + len(meshData)
         except OSError:
             print("Could not open/create file:", outputFile)
         except: #handle other exceptions such as attribute errors
@@ -663,6 +790,402 @@ class Mesh:
         self.drawMode = 4 # Lines
 
         return True
+    def stripifyTriangles(self, indexes, restartIndex):
+        # greedy stripifier, every triangle keeps its original cyclic vertex
+        # order so the strip has the same winding as the triangle list
+        triangles = list(zip(indexes[0::3], indexes[1::3], indexes[2::3]))
+        edges = {}
+        for triangle, (a, b, c) in enumerate(triangles):
+            edges.setdefault((a, b), triangle)
+            edges.setdefault((b, c), triangle)
+            edges.setdefault((c, a), triangle)
+        visited = bytearray(len(triangles))
+
+        def nextVertex(triangle, edge):
+            # vertex following the directed edge in the triangle
+            a, b, c = triangles[triangle]
+            if (a, b) == edge:
+                return c
+            if (b, c) == edge:
+                return a
+            return b
+
+        # start strips on the triangles with the fewest neighbours first,
+        # they are the hardest to pick up later
+        def neighbourCount(triangle):
+            a, b, c = triangles[triangle]
+            return ((b, a) in edges) + ((c, b) in edges) + ((a, c) in edges)
+
+        strips = []
+        for start in sorted(range(len(triangles)), key=neighbourCount):
+            if visited[start]:
+                continue
+            visited[start] = 1
+            a, b, c = triangles[start]
+            strip = [a, b, c]
+            # start with the rotation that can continue into a neighbour
+            for rotation in ((a, b, c), (b, c, a), (c, a, b)):
+                neighbour = edges.get((rotation[2], rotation[1]))
+                if neighbour is not None and not visited[neighbour]:
+                    strip = list(rotation)
+                    break
+            while True:
+                # odd triangles of a strip are (v[k+1], v[k], v[k+2])
+                if len(strip) % 2 == 0:
+                    edge = (strip[-2], strip[-1])
+                else:
+                    edge = (strip[-1], strip[-2])
+                triangle = edges.get(edge)
+                if triangle is None or visited[triangle]:
+                    break
+                visited[triangle] = 1
+                strip.append(nextVertex(triangle, edge))
+            strips.append(strip)
+
+        # join with primitive restart, or with degenerate triangles keeping
+        # every strip starting on an even triangle
+        result = []
+        for strip in strips:
+            if result:
+                if restartIndex is not None:
+                    result.append(restartIndex)
+                else:
+                    joinSize = 2 if len(result) % 2 == 0 else 3
+                    result += [result[-1]] + [strip[0]] * (joinSize - 1)
+            result += strip
+        return result
+    def convertToTriangleStripPrimitive(self, primitiveRestart=False):
+        print("Converting mesh to Triangle Strips")
+        if self.drawMode != 7:
+            print("Conversion not possible with Non-Triangle primitives")
+            return False
+
+        vertexCount = self.vertexBuffer.vertexCount()
+        if len(self.indexBuffer.data) > 0:
+            oldIndexes = self.indexBuffer.indexArray()
+        else:
+            # non indexed triangles, the vertices are the triangle list
+            oldIndexes = array('I', range(vertexCount))
+        # 0xFFFF is the uint16 restart index, it can't be a vertex index
+        componentType = 3 if vertexCount < 65535 else 5
+        restartIndex = None
+        if primitiveRestart:
+            restartIndex = 0xFFFF if componentType == 3 else 0xFFFFFFFF
+
+        # subsets and lods are converted range by range
+        ranges = [(subset.offset, subset.count) for subset in self.subsets]
+        if len(ranges) == 0:
+            ranges = [(0, len(oldIndexes))]
+        ranges += [(lod.offset, lod.count) for lod in self.lods]
+        newRanges = {}
+        newIndexes = array('H' if componentType == 3 else 'I')
+        for offset, count in ranges:
+            if (offset, count) in newRanges:
+                continue
+            strip = self.stripifyTriangles(oldIndexes[offset:offset + count - count % 3], restartIndex)
+            newRanges[(offset, count)] = (len(newIndexes), len(strip))
+            newIndexes += array(newIndexes.typecode, strip)
+        for item in self.subsets + self.lods:
+            item.offset, item.count = newRanges[(item.offset, item.count)]
+
+        print(f"Index count {len(oldIndexes)} -> {len(newIndexes)}")
+        self.indexBuffer.data = packArray(newIndexes)
+        self.indexBuffer.componentType = componentType
+
+        self.drawMode = 5 # TriangleStrip
+
+        return True
+    def triangleCorners(self):
+        # returns the three corner index columns of all subset triangles
+        if len(self.indexBuffer.data) > 0:
+            indexes = self.indexBuffer.indexArray()
+        else:
+            # non indexed triangles, the vertices are the triangle list
+            indexes = array('I', range(self.vertexBuffer.vertexCount()))
+        ranges = [(subset.offset, subset.count) for subset in self.subsets]
+        if len(ranges) == 0:
+            ranges = [(0, len(indexes))]
+        triangles = array(indexes.typecode)
+        for offset, count in ranges:
+            triangles += indexes[offset:offset + count - count % 3]
+        return triangles[0::3], triangles[1::3], triangles[2::3]
+    def cornerAngles(self, positions, corners):
+        # interior angle of every triangle at each of its three corners
+        a, b, c = (gatherVec3(positions, corner) for corner in corners)
+        angles = []
+        for origin, first, second in ((a, b, c), (b, c, a), (c, a, b)):
+            edge1 = subVec3(first, origin)
+            edge2 = subVec3(second, origin)
+            angles.append(list(map(math.atan2, lengthVec3(crossVec3(edge1, edge2)), dotVec3(edge1, edge2))))
+        return angles
+    def generateNormals(self, angleWeighted=False):
+        print("Generating normals")
+        if self.drawMode != 7:
+            print("Normal generation not possible with Non-Triangle primitives")
+            return False
+        if self.vertexBuffer.findEntry('attr_norm') is not None:
+            print("Mesh already contains normals")
+            return False
+        position = self.vertexBuffer.findEntry('attr_pos')
+        positions = self.vertexBuffer.floatColumns(position) if position is not None else None
+        if positions is None or len(positions) < 3:
+            print("Normal generation requires float32 vec3 positions")
+            return False
+
+        count = self.vertexBuffer.vertexCount()
+        corners = self.triangleCorners()
+        a, b, c = (gatherVec3(positions, corner) for corner in corners)
+        # the length of the cross product is twice the triangle area
+        faceNormals = crossVec3(subVec3(b, a), subVec3(c, a))
+        if self.winding == 1:
+            # clockwise front faces
+            faceNormals = tuple(list(map(sub, repeat(0.0), column)) for column in faceNormals)
+        normals = ([0.0] * count, [0.0] * count, [0.0] * count)
+        if angleWeighted:
+            faceNormals = normalizeVec3(faceNormals)
+            for corner, angles in zip(corners, self.cornerAngles(positions, corners)):
+                weighted = scaleVec3(faceNormals, angles)
+                for component in range(3):
+                    scatterAdd(normals[component], corner, weighted[component])
+        else:
+            for corner in corners:
+                for component in range(3):
+                    scatterAdd(normals[component], corner, faceNormals[component])
+
+        self.vertexBuffer.appendFloatEntries([('attr_norm', normalizeVec3(normals))])
+        return True
+    def generateTangents(self):
+        # Tangent basis in the MikkTSpace convention: per triangle tangents
+        # from the uv0 gradients, angle weighted per corner, orthogonalized
+        # against the vertex normal, binormal = cross(normal, tangent) * sign
+        print("Generating tangents")
+        if self.drawMode != 7:
+            print("Tangent generation not possible with Non-Triangle primitives")
+            return False
+        hasTangents = self.vertexBuffer.findEntry('attr_textan') is not None
+        hasBinormals = self.vertexBuffer.findEntry('attr_binormal') is not None
+        if hasTangents and hasBinormals:
+            print("Mesh already contains tangents and binormals")
+            return False
+        if self.vertexBuffer.findEntry('attr_norm') is None and not self.generateNormals(True):
+            return False
+        columns = []
+        for name in ('attr_pos', 'attr_norm', 'attr_uv0'):
+            entry = self.vertexBuffer.findEntry(name)
+            columns.append(self.vertexBuffer.floatColumns(entry) if entry is not None else None)
+        positions, normals, uvs = columns
+        if positions is None or normals is None or uvs is None or len(uvs) < 2:
+            print("Tangent generation requires float32 positions, normals and uv0")
+            return False
+        existingTangents = None
+        if hasTangents:
+            # the binormals have to match the tangents the mesh already has
+            existingTangents = self.vertexBuffer.floatColumns(self.vertexBuffer.findEntry('attr_textan'))
+            if existingTangents is None or len(existingTangents) < 3:
+                print("Binormal generation requires float32 attr_textan")
+                return False
+
+        count = self.vertexBuffer.vertexCount()
+        corners = self.triangleCorners()
+        p0, p1, p2 = (gatherVec3(positions, corner) for corner in corners)
+        u0, u1, u2 = (gatherColumn(uvs[0], corner) for corner in corners)
+        v0, v1, v2 = (gatherColumn(uvs[1], corner) for corner in corners)
+        edge1 = subVec3(p1, p0)
+        edge2 = subVec3(p2, p0)
+        du1 = list(map(sub, u1, u0))
+        dv1 = list(map(sub, v1, v0))
+        du2 = list(map(sub, u2, u0))
+        dv2 = list(map(sub, v2, v0))
+        determinants = list(map(sub, map(mul, du1, dv2), map(mul, du2, dv1)))
+        inverse = [1.0 / determinant if determinant else 0.0 for determinant in determinants]
+        faceTangents = normalizeVec3(scaleVec3(subVec3(scaleVec3(edge1, dv2), scaleVec3(edge2, dv1)), inverse))
+        faceBitangents = normalizeVec3(scaleVec3(subVec3(scaleVec3(edge2, du1), scaleVec3(edge1, du2)), inverse))
+
+        tangents = ([0.0] * count, [0.0] * count, [0.0] * count)
+        bitangents = ([0.0] * count, [0.0] * count, [0.0] * count)
+        for corner, angles in zip(corners, self.cornerAngles(positions, corners)):
+            weightedTangents = scaleVec3(faceTangents, angles)
+            weightedBitangents = scaleVec3(faceBitangents, angles)
+            for component in range(3):
+                scatterAdd(tangents[component], corner, weightedTangents[component])
+                scatterAdd(bitangents[component], corner, weightedBitangents[component])
+
+        # Gram-Schmidt against the normal, handedness from the accumulated bitangent
+        normals = normalizeVec3(normals)
+        if existingTangents is not None:
+            tangents = normalizeVec3(existingTangents[:3])
+        else:
+            tangents = normalizeVec3(subVec3(tangents, scaleVec3(normals, dotVec3(normals, tangents))))
+        binormals = crossVec3(normals, tangents)
+        if existingTangents is not None and len(existingTangents) == 4:
+            signs = [-1.0 if value < 0.0 else 1.0 for value in existingTangents[3]]
+        else:
+            signs = [-1.0 if value < 0.0 else 1.0 for value in dotVec3(binormals, bitangents)]
+        binormals = scaleVec3(binormals, signs)
+
+        attributes = []
+        if not hasTangents:
+            attributes.append(('attr_textan', tangents))
+        if not hasBinormals:
+            attributes.append(('attr_binormal', binormals))
+        self.vertexBuffer.appendFloatEntries(attributes)
+        return True
+    def layoutKey(self):
+        # meshes with the same key can share one vertex and index buffer
+        entries = tuple((entry.name, entry.componentType, entry.numComponents, entry.firstItemOffset) for entry in self.vertexBuffer.entries)
+        return (self.vertexBuffer.stride, entries, self.drawMode, self.winding)
+    def canMerge(self):
+        # strips and fans would need their restart indices remapped, morph
+        # targets and joints are per mesh
+        return (self.drawMode not in (2, 5, 6) and len(self.targetBuffer.entries) == 0
+                and len(self.joints) == 0 and self.vertexBuffer.stride > 0)
+    def subsetsOrWhole(self, indexCount):
+        # meshes without subsets are treated as one subset with computed bounds
+        if len(self.subsets) > 0:
+            return self.subsets
+        subset = self.MeshSubset()
+        subset.count = indexCount
+        position = self.vertexBuffer.findEntry('attr_pos')
+        positions = self.vertexBuffer.floatColumns(position) if position is not None else None
+        if positions is not None and len(positions) >= 3 and len(positions[0]) > 0:
+            subset.bounds.minimum = {'x': min(positions[0]), 'y': min(positions[1]), 'z': min(positions[2])}
+            subset.bounds.maximum = {'x': max(positions[0]), 'y': max(positions[1]), 'z': max(positions[2])}
+        return [subset]
+    def mergeMeshes(self, meshes):
+        # fills this mesh with the concatenation of meshes, every original
+        # subset (with its bounds and lods) stays a subset of the result
+        print(f"Merging {len(meshes)} meshes")
+        if len(meshes) == 0 or any(not mesh.canMerge() or mesh.layoutKey() != meshes[0].layoutKey() for mesh in meshes):
+            print("Merge requires meshes with a compatible layout")
+            return False
+
+        vertexCounts = [mesh.vertexBuffer.vertexCount() for mesh in meshes]
+        componentType = 3 if sum(vertexCounts) < 65535 else 5
+        indexes = array('H' if componentType == 3 else 'I')
+        subsets = []
+        lods = []
+        vertexBase = 0
+        for mesh, vertexCount in zip(meshes, vertexCounts):
+            if len(mesh.indexBuffer.data) > 0:
+                meshIndexes = mesh.indexBuffer.indexArray()
+            else:
+                meshIndexes = range(vertexCount)
+            indexBase = len(indexes)
+            if vertexBase > 0:
+                indexes += array(indexes.typecode, map(add, meshIndexes, repeat(vertexBase)))
+            else:
+                indexes += array(indexes.typecode, meshIndexes)
+            for subset in mesh.subsetsOrWhole(len(meshIndexes)):
+                subset = copy.copy(subset)
+                subset.offset += indexBase
+                subsets.append(subset)
+            for lod in mesh.lods:
+                lod = copy.copy(lod)
+                lod.offset += indexBase
+                lods.append(lod)
+            vertexBase += vertexCount
+
+        first = meshes[0]
+        self.meshInfo = copy.copy(first.meshInfo)
+        self.vertexBuffer = self.VertexBuffer()
+        self.vertexBuffer.stride = first.vertexBuffer.stride
+        self.vertexBuffer.entries = [copy.copy(entry) for entry in first.vertexBuffer.entries]
+        self.vertexBuffer.data = b''.join(bytes(mesh.vertexBuffer.data[:vertexCount * mesh.vertexBuffer.stride]) for mesh, vertexCount in zip(meshes, vertexCounts))
+        self.indexBuffer = self.IndexBuffer()
+        self.indexBuffer.data = packArray(indexes)
+        self.indexBuffer.componentType = componentType
+        self.targetBuffer = self.TargetBuffer()
+        self.subsets = subsets
+        self.lods = lods
+        self.joints = []
+        self.drawMode = first.drawMode
+        self.winding = first.winding
+        return True
+    def splitSubsets(self):
+        # returns one compacted Mesh per subset, only holding the vertices
+        # that subset (and its lods) reference
+        indexes = self.indexBuffer.indexArray()
+        stride = self.vertexBuffer.stride
+        vertexCount = self.vertexBuffer.vertexCount()
+        if len(indexes) == 0:
+            # non indexed subsets are vertex ranges
+            indexes = array('I', range(vertexCount))
+        restartIndex = None
+        if self.drawMode in (2, 5, 6):
+            restartIndex = 0xFFFF if self.indexBuffer.componentType == 3 else 0xFFFFFFFF
+        meshes = []
+        lodIndex = 0
+        for subset in self.subsets:
+            subsetLods = self.lods[lodIndex:lodIndex + subset.lodCount]
+            lodIndex += subset.lodCount
+            ranges = [(subset.offset, subset.count)]
+            for lod in subsetLods:
+                if (lod.offset, lod.count) not in ranges:
+                    ranges.append((lod.offset, lod.count))
+            used = set()
+            for offset, count in ranges:
+                used.update(indexes[offset:offset + count])
+            used.discard(restartIndex)
+            used = sorted(used)
+
+            # contiguous runs of used vertices are copied as single slices
+            runs = []
+            for vertex in used:
+                if runs and runs[-1][1] == vertex:
+                    runs[-1][1] = vertex + 1
+                else:
+                    runs.append([vertex, vertex + 1])
+            componentType = 3 if len(used) < 65535 else 5
+            if len(runs) == 1 and restartIndex is None:
+                first = runs[0][0]
+                remap = lambda values: map(sub, values, repeat(first))
+            else:
+                lookup = {vertex: newVertex for newVertex, vertex in enumerate(used)}
+                if restartIndex is not None:
+                    # the restart index follows the part's (possibly narrower) index type
+                    lookup[restartIndex] = 0xFFFF if componentType == 3 else 0xFFFFFFFF
+                remap = lambda values: map(lookup.__getitem__, values)
+
+            mesh = Mesh()
+            mesh.meshInfo = copy.copy(self.meshInfo)
+            mesh.drawMode = self.drawMode
+            mesh.winding = self.winding
+            mesh.joints = list(self.joints)
+            mesh.vertexBuffer.stride = stride
+            mesh.vertexBuffer.entries = [copy.copy(entry) for entry in self.vertexBuffer.entries]
+            mesh.vertexBuffer.data = b''.join(self.vertexBuffer.data[start * stride:end * stride] for start, end in runs)
+            newIndexes = array('H' if componentType == 3 else 'I')
+            newRanges = {}
+            for offset, count in ranges:
+                newRanges[(offset, count)] = (len(newIndexes), count)
+                newIndexes += array(newIndexes.typecode, remap(indexes[offset:offset + count]))
+            mesh.indexBuffer.data = packArray(newIndexes)
+            mesh.indexBuffer.componentType = componentType
+
+            newSubset = copy.copy(subset)
+            newSubset.offset, newSubset.count = newRanges[(subset.offset, subset.count)]
+            mesh.subsets = [newSubset]
+            for lod in subsetLods:
+                lod = copy.copy(lod)
+                lod.offset, lod.count = newRanges[(lod.offset, lod.count)]
+                mesh.lods.append(lod)
+
+            # version 7 target buffer entries hold one block of vertexCount elements each
+            targetData = []
+            targetSize = 0
+            for entry in self.targetBuffer.entries:
+                elementSize = componentTypeSizes.get(entry.componentType, 4) * entry.numComponents
+                block = self.targetBuffer.data[entry.firstItemOffset:entry.firstItemOffset + vertexCount * elementSize]
+                entry = copy.copy(entry)
+                entry.firstItemOffset = targetSize
+                mesh.targetBuffer.entries.append(entry)
+                for start, end in runs:
+                    targetData.append(block[start * elementSize:end * elementSize])
+                targetSize += len(used) * elementSize
+            mesh.targetBuffer.numTargets = self.targetBuffer.numTargets
+            mesh.targetBuffer.data = b''.join(targetData)
+            meshes.append(mesh)
+        return meshes
 
 class MultiMeshInfo:
     def __init__(self):
@@ -722,14 +1245,19 @@ class MultiMeshInfo:
         return self.fileId == 555777497 and self.fileVersion == 1
 
 class MeshFile:
-    multiMeshInfo = MultiMeshInfo()
-    meshes = {}
+    def __init__(self):
+        self.multiMeshInfo = MultiMeshInfo()
+        self.meshes = {}
+        self.deduplicate = False
 
     def loadMeshFile(self, inputFile):
         self.multiMeshInfo.loadMultiMeshInfo(inputFile);
 
         if self.multiMeshInfo.isValid() and len(self.multiMeshInfo.meshEntries) > 0:
             # This is indeed a MultiMesh file
+            # keep sharing mesh data on save if the entries already share offsets
+            offsets = self.multiMeshInfo.meshEntries.values()
+            self.deduplicate = len(set(offsets)) < len(offsets)
             for entryId in self.multiMeshInfo.meshEntries.keys():
                 offset = self.multiMeshInfo.meshEntries[entryId]
                 mesh = Mesh()
@@ -740,16 +1268,41 @@ class MeshFile:
             mesh = Mesh()
             mesh.loadMesh(inputFile, 0)
             self.meshes[0] = mesh
-    def saveMeshFile(self, outputFile):
+    def saveMeshFile(self, outputFile, deduplicate=None):
+        # With deduplicate, meshes that serialize to the same bytes are only
+        # written once and their MultiMesh entries share the meshOffset.
+        # Returns the number of bytes saved that way.
         print ('Output file is ', outputFile)
+        if deduplicate is None:
+            deduplicate = self.deduplicate
 
         offset = 0
+        savedBytes = 0
+        writtenMeshes = {}
         multiMeshFooter = MultiMeshInfo()
-        for meshIndex, mesh in self.meshes.items():
-            multiMeshFooter.meshEntries[meshIndex] = offset
-            offset = mesh.writeMesh(outputFile, offset)
+        try:
+            with open(outputFile, "wb") as meshFile:
+                for meshIndex, mesh in self.meshes.items():
+                    meshData = mesh.saveMesh()
+                    if deduplicate:
+                        digest = hashlib.blake2b(meshData, digest_size=32).digest()
+                        if digest in writtenMeshes:
+                            multiMeshFooter.meshEntries[meshIndex] = writtenMeshes[digest]
+                            savedBytes += len(meshData)
+                            continue
+                        writtenMeshes[digest] = offset
+                    multiMeshFooter.meshEntries[meshIndex] = offset
+                    meshFile.write(meshData)
+                    offset += len(meshData)
+                meshFile.close()
+        except OSError:
+            print("Could not open/create file:", outputFile)
+            return 0
 
         multiMeshFooter.saveMultiMeshInfo(outputFile)
+        if deduplicate:
+            print(f"Deduplicated {len(self.meshes) - len(writtenMeshes)} meshes, saved {savedBytes} bytes")
+        return savedBytes
 
     def convertToPointsPrimitive(self):
         result = False
@@ -763,6 +1316,63 @@ class MeshFile:
             result &= mesh.convertToLinesPrimitive()
         return result
 
+    def convertToTriangleStripPrimitive(self, primitiveRestart=False):
+        result = True
+        for mesh in self.meshes.values():
+            result &= mesh.convertToTriangleStripPrimitive(primitiveRestart)
+        return result
+
+    def mergeMeshes(self, meshIds=None):
+        # merges meshes with a compatible layout into the first mesh of each
+        # group (lowest id), the other ids are removed
+        groups = {}
+        for meshId, mesh in self.meshes.items():
+            if (meshIds is None or meshId in meshIds) and mesh.canMerge():
+                groups.setdefault(mesh.layoutKey(), []).append(meshId)
+        merged = 0
+        for groupIds in groups.values():
+            if len(groupIds) < 2:
+                continue
+            groupIds.sort()
+            mesh = Mesh()
+            if not mesh.mergeMeshes([self.meshes[meshId] for meshId in groupIds]):
+                continue
+            self.meshes[groupIds[0]] = mesh
+            for meshId in groupIds[1:]:
+                del self.meshes[meshId]
+            merged += len(groupIds) - 1
+        print(f"Merged {merged} meshes, {len(self.meshes)} meshes left")
+        return merged > 0
+
+    def splitMeshes(self):
+        # every subset becomes its own mesh, the first keeps the mesh id
+        nextId = max(self.meshes.keys(), default=-1) + 1
+        meshes = {}
+        for meshId, mesh in self.meshes.items():
+            if len(mesh.subsets) < 2:
+                meshes[meshId] = mesh
+                continue
+            parts = mesh.splitSubsets()
+            meshes[meshId] = parts[0]
+            for part in parts[1:]:
+                meshes[nextId] = part
+                nextId += 1
+        print(f"Split {len(self.meshes)} meshes into {len(meshes)}")
+        self.meshes = meshes
+        return True
+
+    def generateNormals(self, angleWeighted=False):
+        result = True
+        for mesh in self.meshes.values():
+            result &= mesh.generateNormals(angleWeighted)
+        return result
+
+    def generateTangents(self):
+        result = True
+        for mesh in self.meshes.values():
+            result &= mesh.generateTangents()
+        return result
+
     def downgradeMesh(self):
         for mesh in self.meshes.values():
             mesh.meshInfo.fileVersion = 6
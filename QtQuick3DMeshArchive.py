@@ -0,0 +1,418 @@
+#############################################################################
+##
+## Copyright (C) 2022 Andy Nichols <nezticle@gmail.com>
+##
+## You may use this file under the terms of the BSD license as follows:
+##
+## "Redistribution and use in source and binary forms, with or without
+## modification, are permitted provided that the following conditions are
+## met:
+##   * Redistributions of source code must retain the above copyright
+##     notice, this list of conditions and the following disclaimer.
+##   * Redistributions in binary form must reproduce the above copyright
+##     notice, this list of conditions and the following disclaimer in
+##     the documentation and/or other materials provided with the
+##     distribution.
+##
+## THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+## "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+## LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+## A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+## OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+## SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+## LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+## DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+## THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+## (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+## OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE."
+##
+##
+#############################################################################
+
+import os
+import sys
+import lzma
+import time
+import zlib
+import struct
+import hashlib
+import tempfile
+from array import array
+from itertools import accumulate, repeat
+from operator import and_, sub
+from argparse import ArgumentParser
+from QtQuick3DMesh import MeshFile, MultiMeshInfo, alignmentHelper, componentTypeSizes, unpackArray, packArray
+
+# Compressed archive of .mesh data.
+#
+# Every mesh is stored as the bytes Mesh.saveMesh() produces, cut in the
+# sections below and compressed as a single zlib or lzma stream:
+#   prefix  header, Mesh struct, vertex buffer entries and names (as is)
+#   vertex  vertex buffer data, de-interleaved and byte shuffled: byte plane
+#           i of every component of an entry is stored contiguously
+#   index   index buffer data, delta encoded (modulo the index width) and
+#           byte shuffled
+#   middle  subsets, names, lods, joints, target buffer entries (as is)
+#   target  version 7 target buffer data, byte shuffled as float32
+# The alignment padding between sections is always zero and not stored.
+# Decoding runs section by section, so a single mesh can be decompressed
+# from the archive straight into the standard layout without reading the
+# rest of the archive.
+#
+# Archive layout (little endian):
+#   ArchiveHeader (16 bytes): char[4] 'QMAR', UInt32 version, UInt32 codec, UInt32 flags
+#   Records: RecordHeader (40 bytes) + UInt16[permutationSize] + compressed stream
+#   Entries (16 bytes each): UInt64 recordOffset, UInt32 meshId, UInt32 padding
+#   ArchiveFooter (16 bytes): char[4] 'QMAT', UInt32 entriesSize, UInt64 entriesOffset
+# Meshes with identical bytes share one record. Extraction only shares their
+# meshOffset in the .mesh file if the source MeshFile was deduplicated.
+
+ARCHIVE_MAGIC = b'QMAR'
+ARCHIVE_FOOTER_MAGIC = b'QMAT'
+ARCHIVE_VERSION = 1
+
+CODEC_ZLIB = 1
+CODEC_LZMA = 2
+codecNames = {'zlib': CODEC_ZLIB, 'lzma': CODEC_LZMA}
+
+# ArchiveHeader flags
+DEDUPLICATED = 1
+
+# RecordHeader flags
+VERTEX_SHUFFLED = 1
+INDEX_DELTA = 2
+TARGET_SHUFFLED = 4
+HAS_TARGET = 8
+
+RECORD_HEADER = "<10I" # flags, prefixSize, vertexSize, indexSize, middleSize,
+                       # targetSize, stride, indexComponentSize, permutationSize, compressedSize
+
+STREAM_CHUNK_SIZE = 1024 * 1024
+
+def shuffleBytes(data, size):
+    return b''.join(data[byte::size] for byte in range(size))
+
+def unshuffleBytes(data, size):
+    count = len(data) // size
+    output = bytearray(len(data))
+    for byte in range(size):
+        output[byte::size] = data[byte * count:(byte + 1) * count]
+    return output
+
+def vertexPermutation(vertexBuffer):
+    # order of the stride's byte positions in the de-interleaved stream
+    stride = vertexBuffer.stride
+    covered = bytearray(stride)
+    permutation = []
+    for entry in sorted(vertexBuffer.entries, key=lambda entry: entry.firstItemOffset):
+        size = componentTypeSizes.get(entry.componentType)
+        if size is None or entry.firstItemOffset + size * entry.numComponents > stride:
+            continue
+        for byte in range(size):
+            for component in range(entry.numComponents):
+                position = entry.firstItemOffset + component * size + byte
+                if not covered[position]:
+                    covered[position] = 1
+                    permutation.append(position)
+    # bytes no entry claims are kept as well
+    permutation += [position for position in range(stride) if not covered[position]]
+    return permutation
+
+def deltaEncode(data, componentSize):
+    values = unpackArray(data, 3 if componentSize == 2 else 5)
+    mask = 0xFFFF if componentSize == 2 else 0xFFFFFFFF
+    deltas = array(values.typecode, values[:1])
+    deltas += array(values.typecode, map(and_, map(sub, values[1:], values[:-1]), repeat(mask)))
+    return shuffleBytes(packArray(deltas), componentSize)
+
+def deltaDecode(data, componentSize):
+    deltas = unpackArray(bytes(unshuffleBytes(data, componentSize)), 3 if componentSize == 2 else 5)
+    mask = 0xFFFF if componentSize == 2 else 0xFFFFFFFF
+    return packArray(array(deltas.typecode, map(and_, accumulate(deltas), repeat(mask))))
+
+class MeshArchive:
+    class StreamReader:
+        # pulls exact amounts of decompressed data out of one record
+        def __init__(self, archiveFile, compressedSize, codec):
+            self.archiveFile = archiveFile
+            self.remaining = compressedSize
+            self.decompressor = zlib.decompressobj() if codec == CODEC_ZLIB else lzma.LZMADecompressor()
+            self.buffer = bytearray()
+            self.codec = codec
+
+        def read(self, size):
+            while len(self.buffer) < size and self.remaining > 0:
+                chunk = self.archiveFile.read(min(STREAM_CHUNK_SIZE, self.remaining))
+                if not chunk:
+                    break
+                self.remaining -= len(chunk)
+                self.buffer += self.decompressor.decompress(chunk)
+                if self.remaining == 0 and self.codec == CODEC_ZLIB:
+                    self.buffer += self.decompressor.flush()
+            if len(self.buffer) < size:
+                raise ValueError("truncated archive record")
+            data = bytes(self.buffer[:size])
+            del self.buffer[:size]
+            return data
+
+    def __init__(self, codec='zlib', level=None):
+        self.codec = codecNames[codec]
+        self.level = level
+        self.entries = {}
+        self.flags = 0
+
+    def compressor(self):
+        if self.codec == CODEC_ZLIB:
+            return zlib.compressobj(9 if self.level is None else self.level)
+        return lzma.LZMACompressor(preset=6 if self.level is None else self.level)
+
+    def meshSections(self, mesh, meshData):
+        # splits saveMesh() output into (flags, sections, stride, indexComponentSize, permutation)
+        vertexBuffer = mesh.vertexBuffer
+        offset = 12 + 56
+        offset += 16 * len(vertexBuffer.entries) + len(alignmentHelper(16 * len(vertexBuffer.entries)))
+        for entry in vertexBuffer.entries:
+            offset += 4 + len(entry.name) + len(alignmentHelper(len(entry.name)))
+        vertexData = bytes(vertexBuffer.data)
+        indexData = bytes(mesh.indexBuffer.data)
+        vertexStart = offset
+        indexStart = vertexStart + len(vertexData) + len(alignmentHelper(len(vertexData)))
+        middleStart = indexStart + len(indexData) + len(alignmentHelper(len(indexData)))
+        middleEnd = len(meshData)
+        flags = 0
+        targetData = b''
+        if mesh.meshInfo.fileVersion >= 7:
+            flags |= HAS_TARGET
+            targetData = bytes(mesh.targetBuffer.data)
+            middleEnd -= len(targetData) + len(alignmentHelper(len(targetData)))
+
+        located = middleStart <= middleEnd
+        located = located and meshData[vertexStart:vertexStart + len(vertexData)] == vertexData
+        located = located and meshData[indexStart:indexStart + len(indexData)] == indexData
+        located = located and meshData[middleEnd:middleEnd + len(targetData)] == targetData
+        if not located:
+            # unexpected layout, store the bytes as they are
+            return 0, [bytes(meshData), b'', b'', b'', b''], 0, 0, []
+
+        prefix = bytes(meshData[:vertexStart])
+        middle = bytes(meshData[middleStart:middleEnd])
+        stride = vertexBuffer.stride
+        permutation = []
+        if stride > 0 and len(vertexData) % stride == 0 and stride < 65536:
+            permutation = vertexPermutation(vertexBuffer)
+            vertexData = b''.join(vertexData[position::stride] for position in permutation)
+            flags |= VERTEX_SHUFFLED
+        indexComponentSize = componentTypeSizes.get(mesh.indexBuffer.componentType, 0)
+        if indexComponentSize in (2, 4) and len(indexData) % indexComponentSize == 0:
+            indexData = deltaEncode(indexData, indexComponentSize)
+            flags |= INDEX_DELTA
+        if len(targetData) % 4 == 0:
+            targetData = shuffleBytes(targetData, 4)
+            flags |= TARGET_SHUFFLED
+        return flags, [prefix, vertexData, indexData, middle, targetData], stride, indexComponentSize, permutation
+
+    def writeRecord(self, archiveFile, mesh, meshData):
+        flags, sections, stride, indexComponentSize, permutation = self.meshSections(mesh, meshData)
+        recordStart = archiveFile.tell()
+        archiveFile.write(bytes(struct.calcsize(RECORD_HEADER)))
+        archiveFile.write(packArray(array('H', permutation)))
+        compressor = self.compressor()
+        compressedSize = 0
+        for section in sections:
+            for chunkStart in range(0, len(section), STREAM_CHUNK_SIZE):
+                compressed = compressor.compress(section[chunkStart:chunkStart + STREAM_CHUNK_SIZE])
+                archiveFile.write(compressed)
+                compressedSize += len(compressed)
+        compressed = compressor.flush()
+        archiveFile.write(compressed)
+        compressedSize += len(compressed)
+        recordEnd = archiveFile.tell()
+        archiveFile.seek(recordStart)
+        archiveFile.write(struct.pack(RECORD_HEADER, flags, *[len(section) for section in sections],
+                                      stride, indexComponentSize, len(permutation), compressedSize))
+        archiveFile.seek(recordEnd)
+
+    def saveArchive(self, meshFile, outputFile):
+        # returns (uncompressed bytes, archive bytes)
+        print ('Output file is ', outputFile)
+        rawSize = 0
+        records = {}
+        self.entries = {}
+        try:
+            with open(outputFile, "wb") as archiveFile:
+                archiveFlags = DEDUPLICATED if meshFile.deduplicate else 0
+                archiveFile.write(ARCHIVE_MAGIC + struct.pack("<III", ARCHIVE_VERSION, self.codec, archiveFlags))
+                for meshId, mesh in meshFile.meshes.items():
+                    meshData = mesh.saveMesh()
+                    rawSize += len(meshData)
+                    digest = hashlib.blake2b(meshData, digest_size=32).digest()
+                    if digest not in records:
+                        records[digest] = archiveFile.tell()
+                        self.writeRecord(archiveFile, mesh, meshData)
+                    self.entries[meshId] = records[digest]
+                entriesOffset = archiveFile.tell()
+                for meshId, recordOffset in self.entries.items():
+                    archiveFile.write(struct.pack("<QII", recordOffset, meshId, 0))
+                archiveFile.write(ARCHIVE_FOOTER_MAGIC + struct.pack("<IQ", len(self.entries), entriesOffset))
+                archiveSize = archiveFile.tell()
+        except OSError:
+            print("Could not open/create file:", outputFile)
+            return 0, 0
+        return rawSize, archiveSize
+
+    def loadArchiveInfo(self, archiveFile):
+        archiveFile.seek(0)
+        header = archiveFile.read(16)
+        if len(header) < 16 or header[:4] != ARCHIVE_MAGIC:
+            raise ValueError("not a mesh archive")
+        version, self.codec, self.flags = struct.unpack_from("<III", header, 4)
+        if version != ARCHIVE_VERSION or self.codec not in (CODEC_ZLIB, CODEC_LZMA):
+            raise ValueError("unsupported mesh archive version or codec")
+        archiveFile.seek(-16, 2)
+        footer = archiveFile.read(16)
+        if footer[:4] != ARCHIVE_FOOTER_MAGIC:
+            raise ValueError("mesh archive footer missing")
+        entriesSize, entriesOffset = struct.unpack_from("<IQ", footer, 4)
+        archiveFile.seek(entriesOffset)
+        entriesData = archiveFile.read(16 * entriesSize)
+        self.entries = {}
+        for recordOffset, meshId, padding in struct.iter_unpack("<QII", entriesData):
+            self.entries[meshId] = recordOffset
+        return self.entries
+
+    def extractMeshData(self, archiveFile, recordOffset, output):
+        # streams one record back to the standard layout, returns the bytes written
+        archiveFile.seek(recordOffset)
+        (flags, prefixSize, vertexSize, indexSize, middleSize, targetSize,
+         stride, indexComponentSize, permutationSize, compressedSize) = struct.unpack(RECORD_HEADER, archiveFile.read(struct.calcsize(RECORD_HEADER)))
+        permutation = unpackArray(archiveFile.read(2 * permutationSize), 3)
+        reader = self.StreamReader(archiveFile, compressedSize, self.codec)
+
+        output.write(reader.read(prefixSize))
+        written = prefixSize
+        if flags == 0:
+            return written
+
+        vertexData = reader.read(vertexSize)
+        if flags & VERTEX_SHUFFLED and vertexSize > 0:
+            count = vertexSize // stride
+            interleaved = bytearray(vertexSize)
+            for plane, position in enumerate(permutation):
+                interleaved[position::stride] = vertexData[plane * count:(plane + 1) * count]
+            vertexData = interleaved
+        output.write(vertexData)
+        output.write(alignmentHelper(vertexSize))
+
+        indexData = reader.read(indexSize)
+        if flags & INDEX_DELTA and indexSize > 0:
+            indexData = deltaDecode(indexData, indexComponentSize)
+        output.write(indexData)
+        output.write(alignmentHelper(indexSize))
+
+        output.write(reader.read(middleSize))
+        written += len(vertexData) + len(alignmentHelper(vertexSize)) + len(indexData) + len(alignmentHelper(indexSize)) + middleSize
+
+        if flags & HAS_TARGET:
+            targetData = reader.read(targetSize)
+            if flags & TARGET_SHUFFLED:
+                targetData = unshuffleBytes(targetData, 4)
+            output.write(targetData)
+            output.write(alignmentHelper(targetSize))
+            written += targetSize + len(alignmentHelper(targetSize))
+        return written
+
+    def extractArchive(self, inputFile, outputFile, meshIds=None):
+        # writes a .mesh MultiMesh file with all (or only meshIds) meshes
+        print ('Output file is ', outputFile)
+        try:
+            with open(inputFile, "rb") as archiveFile:
+                entries = self.loadArchiveInfo(archiveFile)
+                missing = sorted(set(meshIds) - set(entries)) if meshIds is not None else []
+                if missing:
+                    print("Mesh ids not in archive:", inputFile, missing)
+                    return False
+                multiMeshFooter = MultiMeshInfo()
+                extracted = {}
+                offset = 0
+                with open(outputFile, "wb") as meshFile:
+                    for meshId, recordOffset in entries.items():
+                        if meshIds is not None and meshId not in meshIds:
+                            continue
+                        if recordOffset not in extracted or not self.flags & DEDUPLICATED:
+                            extracted[recordOffset] = offset
+                            offset += self.extractMeshData(archiveFile, recordOffset, meshFile)
+                        multiMeshFooter.meshEntries[meshId] = extracted[recordOffset]
+            multiMeshFooter.saveMultiMeshInfo(outputFile)
+            return True
+        except OSError:
+            print("Could not open/read file:", inputFile)
+        except (ValueError, struct.error, zlib.error, lzma.LZMAError) as error:
+            print("Invalid mesh archive:", inputFile, error)
+        return False
+
+def benchmark(inputFiles):
+    # compression ratio and throughput of the archive against compressing
+    # the .mesh bytes directly with the same codec
+    print(f"{'file':<32} {'method':<14} {'ratio':>7} {'compress MB/s':>14} {'decompress MB/s':>16}")
+    for inputFile in inputFiles:
+        meshFile = MeshFile()
+        meshFile.loadMeshFile(inputFile)
+        rawData = b''.join(mesh.saveMesh() for mesh in meshFile.meshes.values())
+        megabytes = len(rawData) / (1024 * 1024)
+        name = os.path.basename(inputFile)[-32:]
+        with tempfile.TemporaryDirectory() as temporaryDir:
+            archivePath = os.path.join(temporaryDir, "archive.qmar")
+            meshPath = os.path.join(temporaryDir, "extracted.mesh")
+            for codec in ('zlib', 'lzma'):
+                start = time.perf_counter()
+                compressed = zlib.compress(rawData, 9) if codec == 'zlib' else lzma.compress(rawData)
+                compressTime = time.perf_counter() - start
+                start = time.perf_counter()
+                zlib.decompress(compressed) if codec == 'zlib' else lzma.decompress(compressed)
+                decompressTime = time.perf_counter() - start
+                print(f"{name:<32} {codec:<14} {len(rawData) / max(len(compressed), 1):>7.2f} "
+                      f"{megabytes / max(compressTime, 1e-9):>14.1f} {megabytes / max(decompressTime, 1e-9):>16.1f}")
+
+                archive = MeshArchive(codec)
+                start = time.perf_counter()
+                rawSize, archiveSize = archive.saveArchive(meshFile, archivePath)
+                compressTime = time.perf_counter() - start
+                start = time.perf_counter()
+                archive.extractArchive(archivePath, meshPath)
+                decompressTime = time.perf_counter() - start
+                print(f"{name:<32} {'archive-' + codec:<14} {rawSize / max(archiveSize, 1):>7.2f} "
+                      f"{megabytes / max(compressTime, 1e-9):>14.1f} {megabytes / max(decompressTime, 1e-9):>16.1f}")
+
+def main():
+    parser = ArgumentParser(description='Compressed archives of Qt Quick 3D .mesh Files')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    createParser = subparsers.add_parser('create', help='Compress a mesh file into an archive')
+    createParser.add_argument('inputFile', metavar='INPUT', help='Mesh file to load')
+    createParser.add_argument('outputFile', metavar='OUTPUT', help='Output archive file')
+    createParser.add_argument('--codec', choices=sorted(codecNames), default='zlib', help='Compression codec')
+    createParser.add_argument('--level', type=int, default=None, help='Compression level/preset')
+    extractParser = subparsers.add_parser('extract', help='Extract an archive back to a mesh file')
+    extractParser.add_argument('inputFile', metavar='INPUT', help='Archive file to load')
+    extractParser.add_argument('outputFile', metavar='OUTPUT', help='Output mesh file')
+    extractParser.add_argument('--id', type=int, action='append', dest='meshIds', help='Only extract this mesh id (repeatable)')
+    benchmarkParser = subparsers.add_parser('benchmark', help='Compare compression ratio and throughput')
+    benchmarkParser.add_argument('inputFiles', metavar='INPUT', nargs='+', help='Mesh files to benchmark')
+    args = parser.parse_args()
+
+    if args.command == 'create':
+        print ('Input file is ', args.inputFile)
+        meshFile = MeshFile()
+        meshFile.loadMeshFile(args.inputFile)
+        rawSize, archiveSize = MeshArchive(args.codec, args.level).saveArchive(meshFile, args.outputFile)
+        if archiveSize > 0:
+            print(f"{rawSize} -> {archiveSize} bytes ({rawSize / archiveSize:.2f}x)")
+    elif args.command == 'extract':
+        print ('Input file is ', args.inputFile)
+        if not MeshArchive().extractArchive(args.inputFile, args.outputFile, args.meshIds):
+            return 1
+    else:
+        benchmark(args.inputFiles)
+    return 0
+
+if __name__ == "__main__":
+   sys.exit(main())
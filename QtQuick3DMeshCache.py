@@ -0,0 +1,237 @@
+#############################################################################
+##
+## Copyright (C) 2022 Andy Nichols <nezticle@gmail.com>
+##
+## You may use this file under the terms of the BSD license as follows:
+##
+## "Redistribution and use in source and binary forms, with or without
+## modification, are permitted provided that the following conditions are
+## met:
+##   * Redistributions of source code must retain the above copyright
+##     notice, this list of conditions and the following disclaimer.
+##   * Redistributions in binary form must reproduce the above copyright
+##     notice, this list of conditions and the following disclaimer in
+##     the documentation and/or other materials provided with the
+##     distribution.
+##
+## THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+## "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+## LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+## A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+## OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+## SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+## LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+## DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+## THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+## (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+## OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE."
+##
+##
+#############################################################################
+
+import os
+import sys
+import json
+import glob
+import shutil
+import hashlib
+import tempfile
+from argparse import ArgumentParser
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# Content addressed cache for meshTools results.
+#
+# Results are stored under objects/<key[:2]>/<key> where the key hashes the
+# input file contents, the operation, its options and the tool sources. A hit
+# hardlinks (or copies) the stored result to the output without loading the
+# input. Objects are read only so a hardlinked output can't be rewritten in
+# place, least recently used objects are evicted once the cache grows past
+# its size limit. Stats and eviction are serialized with a lock file, objects
+# are published with an atomic rename so readers never see partial files.
+
+DEFAULT_CACHE_SIZE = 1024 * 1024 * 1024
+
+def toolVersion():
+    # any change to the tool sources invalidates previous results
+    hasher = hashlib.blake2b(digest_size=16)
+    for sourceFile in sorted(glob.glob(os.path.join(os.path.dirname(os.path.abspath(__file__)), "*.py"))):
+        with open(sourceFile, "rb") as source:
+            hasher.update(source.read())
+    return hasher.hexdigest()
+
+class CacheLock:
+    def __init__(self, lockFile):
+        self.lockFile = lockFile
+        self.handle = None
+
+    def __enter__(self):
+        self.handle = open(self.lockFile, "a+")
+        if fcntl is not None:
+            fcntl.flock(self.handle.fileno(), fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        if fcntl is not None:
+            fcntl.flock(self.handle.fileno(), fcntl.LOCK_UN)
+        self.handle.close()
+        return False
+
+class MeshCache:
+    def __init__(self, cacheDir, maxSize=DEFAULT_CACHE_SIZE, hardlink=True):
+        self.cacheDir = cacheDir
+        self.maxSize = maxSize
+        self.hardlink = hardlink
+        self.objectsDir = os.path.join(cacheDir, "objects")
+        self.statsFile = os.path.join(cacheDir, "stats.json")
+        os.makedirs(self.objectsDir, exist_ok=True)
+        self.lock = CacheLock(os.path.join(cacheDir, "lock"))
+
+    def key(self, inputFile, operation, options):
+        hasher = hashlib.blake2b(digest_size=32)
+        with open(inputFile, "rb") as input:
+            for chunk in iter(lambda: input.read(1024 * 1024), b''):
+                hasher.update(chunk)
+        hasher.update(json.dumps({"operation": operation, "options": options, "version": toolVersion()}, sort_keys=True).encode('utf-8'))
+        return hasher.hexdigest()
+
+    def objectPath(self, key):
+        return os.path.join(self.objectsDir, key[:2], key)
+
+    def fetch(self, key, outputFile):
+        # returns True and writes outputFile if the result is cached
+        objectPath = self.objectPath(key)
+        try:
+            if not os.path.exists(objectPath):
+                raise FileNotFoundError(objectPath)
+            if os.path.lexists(outputFile):
+                os.remove(outputFile)
+            if self.hardlink:
+                try:
+                    os.link(objectPath, outputFile)
+                except OSError as error:
+                    if not os.path.exists(objectPath):
+                        raise error
+                    # different filesystem or no hardlink support
+                    shutil.copyfile(objectPath, outputFile)
+            else:
+                shutil.copyfile(objectPath, outputFile)
+            os.utime(objectPath) # most recently used
+            hit = True
+        except FileNotFoundError:
+            # not cached, or evicted by another worker in the meantime
+            hit = False
+        self.updateStats(hits=int(hit), misses=int(not hit))
+        return hit
+
+    def store(self, key, outputFile):
+        objectPath = self.objectPath(key)
+        os.makedirs(os.path.dirname(objectPath), exist_ok=True)
+        handle, temporaryPath = tempfile.mkstemp(dir=os.path.dirname(objectPath), prefix=".tmp-")
+        try:
+            with os.fdopen(handle, "wb") as temporaryFile, open(outputFile, "rb") as output:
+                shutil.copyfileobj(output, temporaryFile)
+            os.chmod(temporaryPath, 0o444)
+            size = os.path.getsize(temporaryPath)
+            replaced = os.path.exists(objectPath)
+            os.replace(temporaryPath, objectPath)
+        except OSError:
+            if os.path.exists(temporaryPath):
+                os.remove(temporaryPath)
+            print("Could not store result in cache:", self.cacheDir)
+            return False
+        with self.lock:
+            stats = self.readStats()
+            if not replaced:
+                stats["size"] += size
+                stats["entries"] += 1
+            if stats["size"] > self.maxSize:
+                self.evict(stats)
+            self.writeStats(stats)
+        return True
+
+    def evict(self, stats):
+        # drop least recently used objects until the cache fits, lock must be held
+        objects = []
+        for objectPath in glob.glob(os.path.join(self.objectsDir, "*", "*")):
+            if os.path.basename(objectPath).startswith(".tmp-"):
+                continue
+            try:
+                objectStat = os.stat(objectPath)
+            except FileNotFoundError:
+                continue
+            objects.append((objectStat.st_mtime, objectStat.st_size, objectPath))
+        objects.sort()
+        size = sum(objectSize for mtime, objectSize, objectPath in objects)
+        entries = len(objects)
+        for mtime, objectSize, objectPath in objects:
+            if size <= self.maxSize:
+                break
+            try:
+                os.remove(objectPath)
+            except FileNotFoundError:
+                pass
+            size -= objectSize
+            entries -= 1
+            stats["evictions"] += 1
+        stats["size"] = size
+        stats["entries"] = entries
+
+    def readStats(self):
+        stats = {"hits": 0, "misses": 0, "evictions": 0, "size": 0, "entries": 0}
+        try:
+            with open(self.statsFile, "r") as statsFile:
+                stats.update(json.load(statsFile))
+        except (OSError, ValueError):
+            pass
+        return stats
+
+    def writeStats(self, stats):
+        temporaryPath = self.statsFile + ".tmp"
+        with open(temporaryPath, "w") as statsFile:
+            json.dump(stats, statsFile)
+        os.replace(temporaryPath, self.statsFile)
+
+    def updateStats(self, **counters):
+        with self.lock:
+            stats = self.readStats()
+            for name, value in counters.items():
+                stats[name] += value
+            self.writeStats(stats)
+
+    def stats(self):
+        with self.lock:
+            return self.readStats()
+
+    def clear(self):
+        with self.lock:
+            for objectPath in glob.glob(os.path.join(self.objectsDir, "*", "*")):
+                os.remove(objectPath)
+            self.writeStats({"hits": 0, "misses": 0, "evictions": 0, "size": 0, "entries": 0})
+
+def defaultCacheDir():
+    return os.environ.get("QTQUICK3D_MESH_CACHE", os.path.join(os.path.expanduser("~"), ".cache", "qtquick3d-mesh"))
+
+def main():
+    parser = ArgumentParser(description='Manage the meshTools result cache')
+    parser.add_argument('--cache', metavar='DIR', default=defaultCacheDir(), help='Cache directory')
+    actionGroup = parser.add_mutually_exclusive_group(required=True)
+    actionGroup.add_argument('--stats', help='Print hit/miss statistics', action='store_true')
+    actionGroup.add_argument('--clear', help='Remove all cached results', action='store_true')
+    args = parser.parse_args()
+
+    cache = MeshCache(args.cache)
+    if args.clear:
+        cache.clear()
+    stats = cache.stats()
+    lookups = stats["hits"] + stats["misses"]
+    hitRate = 100.0 * stats["hits"] / lookups if lookups else 0.0
+    print(f"hits: {stats['hits']} misses: {stats['misses']} ({hitRate:.1f}% hit rate)")
+    print(f"entries: {stats['entries']} size: {stats['size']} bytes evictions: {stats['evictions']}")
+    return 0
+
+if __name__ == "__main__":
+   sys.exit(main())
@@ -0,0 +1,350 @@
+#############################################################################
+##
+## Copyright (C) 2022 Andy Nichols <nezticle@gmail.com>
+##
+## You may use this file under the terms of the BSD license as follows:
+##
+## "Redistribution and use in source and binary forms, with or without
+## modification, are permitted provided that the following conditions are
+## met:
+##   * Redistributions of source code must retain the above copyright
+##     notice, this list of conditions and the following disclaimer.
+##   * Redistributions in binary form must reproduce the above copyright
+##     notice, this list of conditions and the following disclaimer in
+##     the documentation and/or other materials provided with the
+##     distribution.
+##
+## THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+## "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+## LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+## A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+## OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+## SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+## LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+## DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+## THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+## (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+## OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE."
+##
+##
+#############################################################################
+
+import sys
+import re
+import struct
+from argparse import ArgumentParser
+from concurrent.futures import ProcessPoolExecutor
+from QtQuick3DMesh import Mesh, componentTypeCodes, componentTypeSizes, unpackArray
+
+# Structural validation of .mesh files.
+#
+# The file is walked with the same offset rules loadMesh uses, but only the
+# fixed size metadata is unpacked. Vertex and index data are checked with
+# bulk array operations (one max() over the index buffer, strided slices for
+# attr_joints) instead of being decoded into per vertex Python objects.
+
+MESH_FILE_ID = 3365961549
+MULTIMESH_FILE_ID = 555777497
+
+morphTargetName = re.compile(r'attr_t(pos|norm|tan|binorm)(\d+)')
+
+class MeshValidationError:
+    def __init__(self, inputFile, meshId, offset, code, message, severity="error"):
+        self.inputFile = inputFile
+        self.meshId = meshId
+        self.offset = offset
+        self.code = code
+        self.message = message
+        self.severity = severity
+
+    def __repr__(self):
+        location = self.inputFile
+        if self.meshId is not None:
+            location += f" (mesh {self.meshId})"
+        return f"{location} @ {self.offset}: {self.severity}: [{self.code}] {self.message}"
+
+class TruncatedMeshData(Exception):
+    pass
+
+class MeshValidator:
+    def __init__(self, inputFile):
+        self.inputFile = inputFile
+        self.data = b''
+        self.errors = []
+        self.meshId = None
+
+    def error(self, offset, code, message, severity="error"):
+        self.errors.append(MeshValidationError(self.inputFile, self.meshId, offset, code, message, severity))
+
+    def unpack(self, format, offset, limit):
+        if offset < 0 or offset + struct.calcsize(format) > limit:
+            raise TruncatedMeshData(offset)
+        return struct.unpack_from(format, self.data, offset)
+
+    def checkPadding(self, start, end, limit):
+        if end > limit:
+            raise TruncatedMeshData(start)
+        if self.data[start:end].count(0) != end - start:
+            self.error(start, "padding", "non zero padding bytes", "warning")
+
+    def validate(self):
+        try:
+            with open(self.inputFile, "rb") as meshFile:
+                self.data = meshFile.read()
+        except OSError:
+            self.error(0, "io", "could not open/read file")
+            return self.errors
+
+        # MultiMesh footer
+        meshEntries = {0: 0}
+        meshLimit = len(self.data)
+        hasFooter = False
+        if len(self.data) >= 16:
+            fileId, fileVersion, entriesOffset, entriesSize = struct.unpack_from("<IIII", self.data, len(self.data) - 16)
+            if fileId == MULTIMESH_FILE_ID:
+                footerStart = len(self.data) - 16 - 16 * entriesSize
+                if fileVersion != 1:
+                    self.error(len(self.data) - 16, "footer-version", f"unsupported MultiMesh version {fileVersion}")
+                    return self.errors
+                if footerStart < 0:
+                    self.error(len(self.data) - 16, "footer-entries", f"{entriesSize} entries do not fit in the file")
+                    return self.errors
+                if entriesSize == 0:
+                    self.error(len(self.data) - 16, "footer-entries", "MultiMesh footer lists no meshes")
+                    return self.errors
+                hasFooter = True
+                meshEntries = {}
+                for entryIndex in range(entriesSize):
+                    meshOffset, meshId, padding = struct.unpack_from("<QII", self.data, footerStart + 16 * entryIndex)
+                    if meshId in meshEntries:
+                        self.error(footerStart + 16 * entryIndex, "footer-duplicate-id", f"mesh id {meshId} appears more than once")
+                    meshEntries[meshId] = meshOffset
+                meshLimit = footerStart
+
+        for meshId, meshOffset in meshEntries.items():
+            self.meshId = meshId
+            if meshOffset % 4:
+                self.error(meshOffset, "mesh-alignment", "mesh offset is not 4 byte aligned")
+            try:
+                self.validateMesh(meshOffset, meshLimit)
+            except TruncatedMeshData as truncated:
+                self.error(truncated.args[0], "truncated", "mesh data extends past the end of the mesh area")
+        self.meshId = None
+
+        if not hasFooter:
+            # a plain mesh file is fine, but it has to end with its mesh data
+            self.error(len(self.data), "footer-missing", "no MultiMesh footer, only the mesh at offset 0 is read", "warning")
+            if len(self.data) >= 12:
+                sizeInBytes, = struct.unpack_from("<I", self.data, 8)
+                meshEnd = 12 + sizeInBytes
+                if len(self.data) > meshEnd:
+                    self.error(meshEnd, "trailing-data", f"{len(self.data) - meshEnd} bytes after the mesh data, the footer may be cut off")
+        return self.errors
+
+    def validateMesh(self, offset, limit):
+        fileId, fileVersion, headerFlags, sizeInBytes = self.unpack("<IHHI", offset, limit)
+        if fileId != MESH_FILE_ID:
+            self.error(offset, "header-magic", f"invalid mesh fileId {fileId}")
+            return
+        if fileVersion < 3 or fileVersion > 7:
+            self.error(offset, "header-version", f"unsupported mesh version {fileVersion}")
+            return
+
+        tracker = Mesh.MeshOffsetTracker(offset + 12)
+        (targetEntriesCount, entriesSize, stride, targetDataSize, vertexDataSize,
+         indexComponentType, indexDataOffset, indexDataSize,
+         numTargets, subsetsSize, jointsOffset, jointsSize,
+         drawMode, winding) = self.unpack("<14I", tracker.offset(), limit)
+        tracker.advance(56)
+        if drawMode < 1 or drawMode > 8:
+            self.error(tracker.offset() - 8, "draw-mode", f"invalid drawMode {drawMode}")
+        if winding not in (1, 2):
+            self.error(tracker.offset() - 4, "winding", f"invalid winding {winding}")
+
+        entries = self.readEntries(tracker, entriesSize, limit)
+
+        # Vertex Buffer Data
+        vertexDataStart = tracker.offset()
+        self.alignedAdvance(tracker, vertexDataSize, limit)
+        vertexCount = 0
+        if vertexDataSize > 0:
+            if stride == 0:
+                self.error(vertexDataStart, "stride", "vertex data without a stride")
+            else:
+                if vertexDataSize % stride:
+                    self.error(vertexDataStart, "stride", f"vertex data size {vertexDataSize} is not a multiple of stride {stride}")
+                vertexCount = vertexDataSize // stride
+        for name, componentType, numComponents, firstItemOffset, entryOffset in entries:
+            if componentType not in componentTypeSizes:
+                self.error(entryOffset, "entry-type", f"{name}: invalid componentType {componentType}")
+                continue
+            if numComponents < 1 or numComponents > 16:
+                self.error(entryOffset, "entry-components", f"{name}: invalid numComponents {numComponents}")
+            elif firstItemOffset + componentTypeSizes[componentType] * numComponents > stride:
+                self.error(entryOffset, "entry-offset", f"{name}: entry at {firstItemOffset} does not fit in stride {stride}")
+            morph = morphTargetName.fullmatch(name)
+            if morph and int(morph.group(2)) > 7:
+                self.error(entryOffset, "entry-morph", f"{name}: morph target index out of range")
+
+        # Index Buffer Data
+        indexDataStart = tracker.offset()
+        self.alignedAdvance(tracker, indexDataSize, limit)
+        indexCount = 0
+        if indexDataSize > 0:
+            if indexComponentType not in (3, 5):
+                self.error(indexDataStart, "index-type", f"invalid index componentType {indexComponentType}")
+            else:
+                indexSize = componentTypeSizes[indexComponentType]
+                if indexDataSize % indexSize:
+                    self.error(indexDataStart, "index-size", f"index data size {indexDataSize} is not a multiple of {indexSize}")
+                indexCount = indexDataSize // indexSize
+                indexes = unpackArray(self.data[indexDataStart:indexDataStart + indexCount * indexSize], indexComponentType)
+                maximum = max(indexes, default=-1)
+                restartIndex = 0xFFFF if indexComponentType == 3 else 0xFFFFFFFF
+                if maximum == restartIndex and drawMode in (2, 5, 6):
+                    # primitive restart index of strips and fans
+                    maximum = max(filter(restartIndex.__ne__, indexes), default=-1)
+                if maximum >= vertexCount:
+                    self.error(indexDataStart, "index-range", f"index {maximum} out of range for {vertexCount} vertices")
+
+        # subsets and lods of non indexed meshes are vertex ranges
+        if indexDataSize > 0:
+            rangeLimit, rangeUnit = indexCount, "indices"
+        else:
+            rangeLimit, rangeUnit = vertexCount, "vertices"
+
+        # Subsets
+        subsetsStart = tracker.offset()
+        subsetFormat = "<II6fII"
+        if fileVersion >= 6:
+            subsetFormat += "III"
+        elif fileVersion >= 5:
+            subsetFormat += "II"
+        subsetSize = struct.calcsize(subsetFormat)
+        subsets = []
+        for subsetIndex in range(subsetsSize):
+            subsetOffset = subsetsStart + subsetIndex * subsetSize
+            values = self.unpack(subsetFormat, subsetOffset, limit)
+            count, indexOffset, nameLength = values[0], values[1], values[9]
+            lodCount = values[12] if fileVersion >= 6 else 0
+            if indexOffset + count > rangeLimit:
+                self.error(subsetOffset, "subset-range", f"subset {subsetIndex} [{indexOffset}, {indexOffset + count}) exceeds {rangeLimit} {rangeUnit}")
+            if drawMode == 7 and count % 3:
+                self.error(subsetOffset, "subset-count", f"subset {subsetIndex} count {count} is not a multiple of 3", "warning")
+            subsets.append((nameLength, lodCount))
+        self.alignedAdvance(tracker, subsetsSize * subsetSize, limit)
+
+        # Subset Names
+        for nameLength, lodCount in subsets:
+            self.alignedAdvance(tracker, nameLength * 2, limit)
+
+        # Lods
+        lodsStart = tracker.offset()
+        lodTotal = sum(lodCount for nameLength, lodCount in subsets)
+        for lodIndex in range(lodTotal):
+            count, indexOffset, distance = self.unpack("<IIf", lodsStart + lodIndex * 12, limit)
+            if indexOffset + count > rangeLimit:
+                self.error(lodsStart + lodIndex * 12, "lod-range", f"lod {lodIndex} [{indexOffset}, {indexOffset + count}) exceeds {rangeLimit} {rangeUnit}")
+        self.alignedAdvance(tracker, lodTotal * 12, limit)
+
+        # Joints
+        jointIds = set()
+        for jointIndex in range(jointsSize):
+            jointId, parentId = self.unpack("<II", tracker.offset(), limit)
+            jointIds.add(jointId)
+            tracker.advance(136)
+        if tracker.offset() > limit:
+            raise TruncatedMeshData(tracker.offset())
+        if jointsSize > 0:
+            self.validateJointReferences(entries, stride, vertexDataStart, vertexCount, jointIds)
+
+        # Target Buffer
+        if fileVersion >= 7:
+            targetEntries = self.readEntries(tracker, targetEntriesCount, limit)
+            targetDataStart = tracker.offset()
+            self.alignedAdvance(tracker, targetDataSize, limit)
+            if targetEntriesCount > 0 and numTargets == 0:
+                self.error(targetDataStart, "target-count", "target buffer entries without targets")
+            for name, componentType, numComponents, firstItemOffset, entryOffset in targetEntries:
+                morph = morphTargetName.fullmatch(name)
+                if morph is None:
+                    self.error(entryOffset, "target-name", f"unexpected target buffer entry {name}", "warning")
+                elif int(morph.group(2)) >= numTargets:
+                    self.error(entryOffset, "target-index", f"{name}: target index out of range for {numTargets} targets")
+                if componentType not in componentTypeSizes:
+                    self.error(entryOffset, "entry-type", f"{name}: invalid componentType {componentType}")
+                    continue
+                blockEnd = firstItemOffset + vertexCount * componentTypeSizes[componentType] * numComponents
+                if blockEnd > targetDataSize:
+                    self.error(entryOffset, "target-size", f"{name}: needs {blockEnd} bytes of target data, only {targetDataSize} present")
+
+        if sizeInBytes != tracker.byteCounter:
+            self.error(offset + 8, "header-size", f"sizeInBytes is {sizeInBytes}, layout is {tracker.byteCounter} bytes")
+
+    def alignedAdvance(self, tracker, size, limit):
+        start = tracker.offset() + size
+        tracker.alignedAdvance(size)
+        self.checkPadding(start, tracker.offset(), limit)
+
+    def readEntries(self, tracker, count, limit):
+        entries = []
+        for entryIndex in range(count):
+            entryOffset = tracker.offset() + 16 * entryIndex
+            nameOffset, componentType, numComponents, firstItemOffset = self.unpack("<4I", entryOffset, limit)
+            entries.append([componentType, numComponents, firstItemOffset, entryOffset])
+        self.alignedAdvance(tracker, 16 * count, limit)
+        namedEntries = []
+        for componentType, numComponents, firstItemOffset, entryOffset in entries:
+            nameLength, = self.unpack("<I", tracker.offset(), limit)
+            tracker.advance(4)
+            if tracker.offset() + nameLength > limit:
+                raise TruncatedMeshData(tracker.offset())
+            try:
+                name = self.data[tracker.offset():tracker.offset() + nameLength].decode('utf-8').rstrip('\x00')
+            except UnicodeDecodeError:
+                self.error(tracker.offset(), "entry-name", "entry name is not valid UTF-8")
+                name = ""
+            self.alignedAdvance(tracker, nameLength, limit)
+            namedEntries.append((name, componentType, numComponents, firstItemOffset, entryOffset))
+        return namedEntries
+
+    def validateJointReferences(self, entries, stride, vertexDataStart, vertexCount, jointIds):
+        for name, componentType, numComponents, firstItemOffset, entryOffset in entries:
+            if name != 'attr_joints' or componentType not in componentTypeCodes or vertexCount == 0:
+                continue
+            size = componentTypeSizes[componentType]
+            if stride % size or firstItemOffset % size:
+                continue
+            values = unpackArray(self.data[vertexDataStart:vertexDataStart + vertexCount * stride], componentType)
+            referenced = set()
+            for component in range(numComponents):
+                referenced.update(values[firstItemOffset // size + component::stride // size])
+            missing = sorted(int(jointId) for jointId in referenced if int(jointId) not in jointIds)
+            if missing:
+                self.error(entryOffset, "joint-reference", f"attr_joints references unknown joints {missing[:8]}")
+
+def validateMeshFile(inputFile):
+    return MeshValidator(inputFile).validate()
+
+def validateMeshFiles(inputFiles, workers=None):
+    # validates every file in a separate process, returns {file: errors}
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        return dict(zip(inputFiles, executor.map(validateMeshFile, inputFiles)))
+
+def main():
+    parser = ArgumentParser(description='Validate the structure of Qt Quick 3D .mesh Files')
+    parser.add_argument('inputFiles', metavar='INPUT', nargs='+', help='Mesh files to validate')
+    parser.add_argument('-j', '--jobs', type=int, default=None, help='Number of parallel workers')
+    parser.add_argument('--strict', help='Treat warnings as errors', action='store_true')
+    args = parser.parse_args()
+
+    result = 0
+    for inputFile, errors in validateMeshFiles(args.inputFiles, args.jobs).items():
+        for error in errors:
+            print(error)
+            if error.severity == "error" or args.strict:
+                result = 1
+    return result
+
+if __name__ == "__main__":
+   sys.exit(main())
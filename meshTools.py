@@ -29,20 +29,35 @@
 ##
 #############################################################################
 
+import os
 import sys
 from QtQuick3DMesh import MeshFile
+from QtQuick3DGlb import GlbFile
+from QtQuick3DMeshCache import MeshCache, defaultCacheDir
 from argparse import ArgumentParser
 
 def main():
 
     parser = ArgumentParser(description='Utilities for Qt Quick 3D .mesh Files')
     modeGroup = parser.add_mutually_exclusive_group()
-    parser.add_argument('inputFile', metavar='INPUT', help='Mesh file to load')
-    parser.add_argument('outputFile', metavar='OUTPUT', help='Output mesh file')
+    parser.add_argument('inputFile', metavar='INPUT', help='Mesh file to load (.mesh or .glb)')
+    parser.add_argument('outputFile', metavar='OUTPUT', help='Output mesh file (.mesh or .glb)')
     modeGroup.add_argument('--points', help='Convert Mesh to Points', action='store_true')
     modeGroup.add_argument('--lines', help='Convert Mesh to Lines', action='store_true')
+    modeGroup.add_argument('--strips', help='Convert Mesh to Triangle Strips (degenerate joins)', action='store_true')
+    modeGroup.add_argument('--strips-restart', help='Convert Mesh to Triangle Strips (primitive restart joins)', action='store_true')
     modeGroup.add_argument('--print', help='Print Mesh data', action='store_true')
     modeGroup.add_argument('--downgrade', help='Downgrade Mesh to a lower version', action='store_true')
+    modeGroup.add_argument('--merge', help='Merge meshes with a compatible layout into shared buffers', action='store_true')
+    modeGroup.add_argument('--split', help='Split every subset into its own compacted mesh', action='store_true')
+    modeGroup.add_argument('--normals', help='Generate missing normals (area weighted)', action='store_true')
+    modeGroup.add_argument('--angle-normals', help='Generate missing normals (angle weighted)', action='store_true')
+    modeGroup.add_argument('--tangents', help='Generate missing tangents and binormals', action='store_true')
+    parser.add_argument('--dedup', help='Store identical meshes only once in the output file', action='store_true')
+    parser.add_argument('--cache', help='Reuse results of earlier runs on unchanged inputs', action='store_true')
+    parser.add_argument('--cache-dir', metavar='DIR', default=defaultCacheDir(), help='Result cache directory')
+    parser.add_argument('--cache-size', metavar='MB', type=int, default=1024, help='Result cache size limit in MB')
+    parser.add_argument('--cache-copy', help='Copy cached results instead of hardlinking them', action='store_true')
     args = parser.parse_args()
 
     inputfile = args.inputFile
@@ -50,16 +65,53 @@ def main():
 
     print ('Input file is ', inputfile)
 
+    # A cache hit writes the output without loading the input at all
+    cache = None
+    if args.cache and not args.print:
+        cache = MeshCache(args.cache_dir, args.cache_size * 1024 * 1024, not args.cache_copy)
+        operation = 'none'
+        for mode in ('points', 'lines', 'strips', 'strips_restart', 'downgrade', 'merge', 'split', 'normals', 'angle_normals', 'tangents'):
+            if getattr(args, mode):
+                operation = mode
+        options = {
+            'dedup': args.dedup,
+            'inputFormat': os.path.splitext(inputfile)[1].lower(),
+            'outputFormat': os.path.splitext(outputFile)[1].lower()
+        }
+        cacheKey = cache.key(inputfile, operation, options)
+        if cache.fetch(cacheKey, outputFile):
+            print ('Output file is ', outputFile, '(cached)')
+            return 0
+
     meshFile = MeshFile()
-    meshFile.loadMeshFile(inputfile)
+    if inputfile.lower().endswith('.glb'):
+        glbFile = GlbFile()
+        glbFile.loadGlbFile(inputfile)
+        meshFile.meshes = glbFile.meshes
+    else:
+        meshFile.loadMeshFile(inputfile)
 
     # Preform actions
     if args.points:
         meshFile.convertToPointsPrimitive()
     elif args.lines:
         meshFile.convertToLinesPrimitive()
+    elif args.strips:
+        meshFile.convertToTriangleStripPrimitive()
+    elif args.strips_restart:
+        meshFile.convertToTriangleStripPrimitive(True)
     elif args.downgrade:
         meshFile.downgradeMesh()
+    elif args.merge:
+        meshFile.mergeMeshes()
+    elif args.split:
+        meshFile.splitMeshes()
+    elif args.normals:
+        meshFile.generateNormals()
+    elif args.angle_normals:
+        meshFile.generateNormals(True)
+    elif args.tangents:
+        meshFile.generateTangents()
     elif args.print:
         for id,mesh in meshFile.meshes.items():
             mesh.vertexBuffer.unpackAttributes()
@@ -67,7 +119,18 @@ def main():
 
 
     # Save new File
-    meshFile.saveMeshFile(outputFile)
+    # (unlink first, the old output may be a hardlink into the cache)
+    if os.path.lexists(outputFile):
+        os.remove(outputFile)
+    if outputFile.lower().endswith('.glb'):
+        glbFile = GlbFile()
+        glbFile.meshes = meshFile.meshes
+        glbFile.saveGlbFile(outputFile)
+    else:
+        meshFile.saveMeshFile(outputFile, args.dedup or None)
+
+    if cache is not None and os.path.exists(outputFile):
+        cache.store(cacheKey, outputFile)
 
     return 0
 